@@ -1,9 +1,28 @@
-import xml.etree.cElementTree as ET
-#import xml.dom.minidom as minidom
+import argparse
+import bz2
+import gzip
+import multiprocessing
+import os
+import tempfile
+import time
 
+import numpy as np
 from shapely.geometry import LineString,MultiLineString
+from shapely.ops import linemerge,unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 import json
 
+from shpreader import iterShapefileFeatures
+from instrumentation import Instrumentation
+from noderegistry import NodeRegistry
+from pbfwriter import PBFWriter
+from rings import assembleRings,ringRoles
+from simplify import simplifyWays
+from stagecache import StageCache,hashFile,hashParts
+from tiles import TileFiles,homeTile,lineTiles
+from topology import arcSides,buildTopology
+
 
 #Set MAINTENANCE True if you want a tofix_splittedways.osm file be generated with the cleaned splitted ways geojson
 #This is useful for example if you want to join TOO SMALL segments using JOSM
@@ -13,63 +32,271 @@ ALL_LEVELS_GEOJSON = 'fiji_level8.geojson'
 #Now the SPLITTED_WAYS_GEOJSON file we create it from the ALL_LEVELS_GEOJSON files one by using QGIS and converting polygons to lines
 #and breaking the lines using the .break function of the GRASS plugin
 SPLITTED_WAYS_GEOJSON = 'fiji_splitted.geojson'
+#Both files can also be newline-delimited GeoJSON (.geojsonl or .geojsonseq), with one feature per line
+
+#Set SHAPEFILE to the .shp file with the deeper level polygons to read it directly, without the QGIS and
+#GRASS steps: the splitted ways are computed from the shared edges of the polygons,
+#and ALL_LEVELS_GEOJSON and SPLITTED_WAYS_GEOJSON are not used
+SHAPEFILE = None
+
+#Set TOPOLOGY True to build the boundary ways from the shared edges of the deeper level polygons themselves,
+#knowing the polygons at both sides of every way without searching them. SPLITTED_WAYS_GEOJSON is not used.
+#A vertex of a polygon closer than half a unit of COORDINATES_PRECISION to a segment of its neighbour is added
+#to that segment, so the borders are shared even when only one of the polygons had a vertex there.
+TOPOLOGY = False
 
 OTHER_LEVELS = [{"level":"6", "uniquetag": "PID" ,"nametag":"PROVINCE"}]
 DEEPER_LEVEL = {"level":"8", "uniquetag": "TID" ,"nametag":"TIKINA"}
 
+#The .osm file generated, it's compressed if the name ends with .gz or .bz2
+OUTPUT_OSM = 'final.osm'
+#Size of the write buffer of the .osm file
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+#The ways of every relation are chained into rings before saving: the members are ordered along each ring
+#and the holes get the inner role. The relations with rings that don't close are written to RINGS_REPORT,
+#if it's set, as JSON lines. Set ASSEMBLE_RINGS False to write the ways as found, all of them as outer.
+ASSEMBLE_RINGS = True
+RINGS_REPORT = None
+
+#Size of the chunks read from the GeoJSON files, and how many splitted ways are rounded together
+INPUT_BUFFER_SIZE = 1024 * 1024
+READ_BATCH_SIZE = 10000
+
+#Number of decimals kept in the coordinates, 5 decimals are about 1 meter
+COORDINATES_PRECISION = 5
+
+#The ways with more nodes than MAX_WAY_NODES are split into several ways, as the OSM API rejects the ways
+#over 2000 nodes. The relations get the parts in place of the way. Set it to None to keep the ways whole.
+MAX_WAY_NODES = 2000
+
+#Set SIMPLIFY_TOLERANCE to a distance in degrees to simplify the boundary ways (Douglas-Peucker) once their
+#relations are found. The ends of the ways and the vertices shared by several ways are kept.
+SIMPLIFY_TOLERANCE = None
+
+#Set SPATIAL_INDEX False to test every splitted way against every polygon (the original brute-force search)
+#Set CHECK_SPATIAL_INDEX True to run both searches for every way and print any way where they disagree
+SPATIAL_INDEX = True
+CHECK_SPATIAL_INDEX = False
+
+#Number of processes detecting the relations of the ways, it can also be set with --jobs N
+JOBS = 1
+
+#Set TILE_SIZE to a size in degrees to convert the splitted ways tile by tile, for inputs too big to clean
+#and search all at once. The ways and polygons are partitioned into a grid of tiles in temporary files,
+#every tile is cleaned and searched with only the ways and polygons passing through it (in JOBS processes).
+#The output is the same as without tiles. The stage cache is not used with tiles.
+#With SHAPEFILE, the shared edges are still computed from all the polygons at once before the tiling,
+#so the memory used is only bounded when the splitted ways are read from SPLITTED_WAYS_GEOJSON.
+TILE_SIZE = None
+
+#Set CACHE_DIR to a directory to keep there the result of every stage. When the same inputs are
+#converted again only the changed parts are computed: the stages whose inputs did not change are loaded,
+#and only the ways near changed polygons are searched again. The oldest entries are removed above CACHE_MAX_SIZE bytes.
+CACHE_DIR = None
+CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+#Set METRICS_FILE to write the wall time, peak memory and item counts of every stage as JSON lines.
+#Set PROFILE to 'cprofile' to save a profile_<stage>.prof file for every stage (profile_<stage>_2.prof for
+#its second measure, like recalculateEdges), or to 'tracemalloc' to add the peak of the Python allocations
+#of every stage to its metrics.
+METRICS_FILE = None
+PROFILE = None
+
 
 
 #DON'T MODIFY THE CODE FROM DOWN HERE UNLESS YOU KNOW PYTHON OR LIKE TO HACK AROUND.
-all_levels_num = [DEEPER_LEVEL["level"]]
-upper_rel = {}
-relations = {}
-boundarynames = {}
-
-for l in OTHER_LEVELS:
-    n = l["level"]
-    upper_rel[n] = dict()
-    all_levels_num.append(n)
-    
-for n in all_levels_num:
-    relations[n] = dict()
-    boundarynames[n] = dict()
 
-unique_nodes = {}
-node_counter = -1
-def getUniqueNodeId(point):
-    global node_counter
-    global unique_nodes
-    lonlat = str(point[0]) + "," + str(point[1])
-    if  not lonlat in unique_nodes:
-        node_counter -= 1
-        unique_nodes[lonlat] = node_counter
-        return node_counter
-    else: return unique_nodes[lonlat]
+#The settings of one conversion. By default they are the module settings above, and any of them
+#can be changed with a keyword argument, e.g. ConverterConfig(shapefile='fiji.shp', jobs=4)
+class ConverterConfig(object):
+    def __init__(self, **settings):
+        self.maintenance = MAINTENANCE
+        self.all_levels_geojson = ALL_LEVELS_GEOJSON
+        self.splitted_ways_geojson = SPLITTED_WAYS_GEOJSON
+        self.shapefile = SHAPEFILE
+        self.topology = TOPOLOGY
+        self.other_levels = OTHER_LEVELS
+        self.deeper_level = DEEPER_LEVEL
+        self.output_osm = OUTPUT_OSM
+        self.output_buffer_size = OUTPUT_BUFFER_SIZE
+        self.assemble_rings = ASSEMBLE_RINGS
+        self.rings_report = RINGS_REPORT
+        self.input_buffer_size = INPUT_BUFFER_SIZE
+        self.read_batch_size = READ_BATCH_SIZE
+        self.coordinates_precision = COORDINATES_PRECISION
+        self.simplify_tolerance = SIMPLIFY_TOLERANCE
+        self.max_way_nodes = MAX_WAY_NODES
+        self.spatial_index = SPATIAL_INDEX
+        self.check_spatial_index = CHECK_SPATIAL_INDEX
+        self.jobs = JOBS
+        self.tile_size = TILE_SIZE
+        self.cache_dir = CACHE_DIR
+        self.cache_max_size = CACHE_MAX_SIZE
+        self.metrics_file = METRICS_FILE
+        self.profile = PROFILE
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise TypeError("Unknown setting %r" % name)
+            setattr(self, name, value)
+
+
+#Rounds a whole array of [lon,lat] coordinates to COORDINATES_PRECISION decimals at once.
+#The result is the same as formatting every number with "{0:.5f}" and parsing it back.
+def reduceFloat(geom,precision=None):
+    if precision is None:
+        precision = COORDINATES_PRECISION
+    coords = np.asarray(geom, dtype=float)
+    scale = 10 ** precision
+    scaled = coords * scale
+    rounded = np.rint(scaled)
+    #Only the numbers too close to a half can be rounded differently than the string formatting,
+    #those few are rounded again one by one from their exact decimal value
+    ambiguous = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if ambiguous.any():
+        text_format = "{0:.%df}" % precision
+        rounded[ambiguous] = [round(float(text_format.format(x)) * scale) for x in coords[ambiguous]]
+    return rounded / scale
 
 
+#Rounds a list of coordinate arrays with a single reduceFloat call.
+#The time spent and the coordinates rounded are added to the rounding dict when it's given.
+def reduceFloatGeometries(geoms,precision=None,rounding=None):
+    if not geoms:
+        return []
+    start = time.perf_counter()
+    offsets = np.cumsum([len(geom) for geom in geoms])[:-1]
+    coords = reduceFloat([p[:2] for geom in geoms for p in geom], precision)
+    if rounding is not None:
+        rounding["wall_time"] = rounding.get("wall_time", 0.0) + time.perf_counter() - start
+        rounding["coordinates"] = rounding.get("coordinates", 0) + len(coords)
+    return np.split(coords, offsets)
 
-def reduceFloat(geom):
-    new_geom = []
-    for p in geom:
-        #print p
-        p = [float("{0:.5f}".format(p[0])), float("{0:.5f}".format(p[1]))]
-        new_geom.append(p)
-    return new_geom
 
 
+#Newline-delimited GeoJSON files have one feature per line
+NEWLINE_DELIMITED_EXTENSIONS = ('.geojsonl', '.geojsons', '.geojsonseq', '.ndjson', '.jsonl')
+
+
+#Reads the features of a GeoJSON file one at a time, without loading the whole file in memory.
+#A FeatureCollection is decoded feature by feature from a buffer filled in buffer_size chunks,
+#and newline-delimited GeoJSON is decoded line by line.
+def iterFeatures(filename,buffer_size=None):
+    if filename.endswith(NEWLINE_DELIMITED_EXTENSIONS):
+        with open(filename, encoding="utf-8") as f:
+            for line in f:
+                #GeoJSON text sequences start every feature with a record separator
+                line = line.strip().lstrip("\x1e")
+                if line:
+                    yield json.loads(line)
+        return
+
+    with open(filename, encoding="utf-8") as f:
+        reader = JSONStreamReader(f, buffer_size or INPUT_BUFFER_SIZE)
+        reader.expect("{")
+        if reader.skip("}"):
+            return
+        while True:
+            key = reader.decode()
+            reader.expect(":")
+            if key != "features":
+                reader.decode()
+            else:
+                reader.expect("[")
+                if not reader.skip("]"):
+                    yield reader.decode()
+                    while reader.skip(","):
+                        yield reader.decode()
+                    reader.expect("]")
+            if not reader.skip(","):
+                reader.expect("}")
+                return
+
+
+#Decodes JSON values one after the other from a file, reading more of it only when a value is incomplete
+class JSONStreamReader(object):
+    def __init__(self, f, buffer_size=None):
+        self.f = f
+        self.buffer_size = buffer_size or INPUT_BUFFER_SIZE
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size):
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    #Moves to the next non blank character and returns it, "" at the end of the file
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill(self.buffer_size)
+
+    def skip(self, char):
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, char):
+        if not self.skip(char):
+            raise ValueError("Expected %r at character %d of the GeoJSON, found %r" % (char, self.pos, self.peek()))
+
+    def decode(self):
+        self.peek()
+        size = self.buffer_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                #A number at the end of the buffer could still continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(size)
+            size *= 2
+
+
+#Breaks the polygons rings into the lines shared by the same polygons, as the GRASS break does.
+#The union nodes all the rings together and leaves each shared edge only once, then linemerge joins
+#the pieces again between the points where three or more lines meet.
+def sharedEdgeFeatures(features,precision=None,rounding=None):
+    rings = []
+    for feature in features:
+        if not feature['properties']: continue
+        for polygon in feature['geometry']['coordinates']:
+            rings.extend(polygon)
+    lines = [LineString(geom) for geom in reduceFloatGeometries(rings,precision,rounding)]
+    merged = linemerge(unary_union(lines))
+    if merged.is_empty:
+        return
+    if merged.geom_type == 'LineString':
+        merged = [merged]
+    else:
+        merged = merged.geoms
+    for line in merged:
+        yield {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'LineString', 'coordinates': list(line.coords)}}
+
 
 #Loading the Geojson with the boundaries
-def fillingLevelWays(data,uniquetag):
+def fillingLevelWays(features,uniquetag,precision=None,rounding=None):
     boundaries = {}
-    for feature in data['features']:
+    for feature in features:
         if not feature['properties']: continue
         uniqueidentif = feature['properties'][uniquetag]
         boundaries[uniqueidentif] = {'properties': feature['properties']}
         poligon = feature['geometry']['coordinates']
-        lines = []
-        for i in poligon:
-            for geom in i:
-                lines.append(LineString(reduceFloat(geom)))
+        rings = [geom for i in poligon for geom in i]
+        lines = [LineString(geom) for geom in reduceFloatGeometries(rings,precision,rounding)]
         boundaries[uniqueidentif]["geometry"] = MultiLineString(lines)
     return boundaries
 
@@ -82,49 +309,209 @@ def addEdgePoint(edgepoints_ocurrences,point_id):
     else: edgepoints_ocurrences[point_id] = 1
     
     
-def recalculateEdges(tempways):
+def recalculateEdges(tempways,node_registry):
     edgepoints_ocurrences = {}
     for way in tempways:
-        addEdgePoint(edgepoints_ocurrences, getUniqueNodeId(way.coords[0]))
-        addEdgePoint(edgepoints_ocurrences, getUniqueNodeId(way.coords[-1]))
+        addEdgePoint(edgepoints_ocurrences, node_registry.getUniqueNodeId(way.coords[0]))
+        addEdgePoint(edgepoints_ocurrences, node_registry.getUniqueNodeId(way.coords[-1]))
     return edgepoints_ocurrences
 
 
 
+#Cuts the way at every interior coordinate that is a vertex (the edge of another way), in one pass
+def splitWayAtVertices(way,vertices,node_registry):
+    coords = list(way.coords)
+    last = len(coords) - 1
+    pieces = []
+    start = 0
+    for n in range(1,last):
+        coord = coords[n]
+        if node_registry.getUniqueNodeId(coord) in vertices:
+            print("Found vertice in middle of way, search in JOSM as ",coord[1]," ",coord[0])
+            pieces.append(LineString(coords[start:n+1]))
+            start = n
+    if not pieces:
+        return [way]
+    pieces.append(LineString(coords[start:]))
+    return pieces
+
+
+#The same way drawn twice, in either direction, has the same key. A closed way drawn again from another
+#vertex has a different key, it's removed by the within check instead.
+def wayKey(way):
+    coords = tuple(way.coords)
+    reversed_coords = coords[::-1]
+    return min(coords, reversed_coords)
+
+
+#A way is removed when it is within another way kept before it.
+#Exact duplicates are dropped first with a hash lookup, and only the remaining ways
+#go through an STRtree for the real within check against the earlier kept ways.
+def removeOverlappingWays(ways):
+    candidates = []
+    seen_keys = set()
+    exact_duplicates = 0
+    for way in ways:
+        key = wayKey(way)
+        if key in seen_keys:
+            exact_duplicates += 1
+        else:
+            seen_keys.add(key)
+            candidates.append(way)
+
+    tree = STRtree(candidates)
+    kept = [False] * len(candidates)
+    post_ways = []
+    contained_ways = 0
+    for i,way in enumerate(candidates):
+        if i % 100 == 0:
+            print(i)
+        repeated = False
+        for j in tree.query(way, predicate="within"):
+            if j < i and kept[j]:
+                repeated = True
+                break
+        if repeated:
+            contained_ways += 1
+        else:
+            kept[i] = True
+            post_ways.append(way)
+    return post_ways,exact_duplicates,contained_ways
+
+
+#Removes the same ways as removeOverlappingWays from the ways of a tile, given with all the earlier ways
+#that pass through the tile. A way within a removed way is also within the way that removed it, so a way
+#is removed when it's within any earlier way, kept or not. Only the ways that are tested are checked,
+#the indexes of the ones kept are returned.
+def removeOverlappingTileWays(ways,tested):
+    tree = STRtree(ways)
+    seen_keys = set()
+    kept = []
+    exact_duplicates = 0
+    contained_ways = 0
+    for i,way in enumerate(ways):
+        key = wayKey(way)
+        if tested[i]:
+            if key in seen_keys:
+                exact_duplicates += 1
+            elif any(j < i for j in tree.query(way, predicate="within")):
+                contained_ways += 1
+            else:
+                kept.append(i)
+        seen_keys.add(key)
+    return kept,exact_duplicates,contained_ways
+
+
 #f = open("tofix.geojson", 'w')
 ##fc = geojson.FeatureCollection(features)
 #f.write(json.dumps(mapping(multiline)) )
 #f.close()        
 
-def save(uniqueways_ref,unique_nodes,allrelations,output_filename):
-    osm_header = "<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6' upload='true' generator='JOSM'>\n</osm>"
-    r = ET.fromstring(osm_header)
+#Same escaping as ElementTree does for the attribute values
+def escapeAttrib(value):
+    value = str(value)
+    if "&" in value:
+        value = value.replace("&", "&amp;")
+    if "<" in value:
+        value = value.replace("<", "&lt;")
+    if ">" in value:
+        value = value.replace(">", "&gt;")
+    if "\"" in value:
+        value = value.replace("\"", "&quot;")
+    if "\r" in value:
+        value = value.replace("\r", "&#13;")
+    if "\n" in value:
+        value = value.replace("\n", "&#10;")
+    if "\t" in value:
+        value = value.replace("\t", "&#09;")
+    return value
+
+
+#The output is compressed when the filename ends with .gz or .bz2
+def openOutput(output_filename,buffer_size=None):
+    if output_filename.endswith(".gz"):
+        return gzip.open(output_filename, "wt", encoding="utf-8", newline="")
+    if output_filename.endswith(".bz2"):
+        return bz2.open(output_filename, "wt", encoding="utf-8", newline="")
+    return open(output_filename, "w", encoding="utf-8", newline="", buffering=buffer_size or OUTPUT_BUFFER_SIZE)
+
+
+#Splits the ways with more than max_nodes nodes into parts of max_nodes nodes, each part starting at the
+#last node of the previous one. The first part keeps the way_ref and the others get new ones after the last way_ref.
+#Returns the refs of the parts of every way split.
+def splitLongWays(uniqueways_ref,max_nodes):
+    if max_nodes < 2:
+        raise ValueError("A way needs at least 2 nodes, max_nodes is %d" % max_nodes)
+    parts = {}
+    next_ref = max(uniqueways_ref) + 1 if uniqueways_ref else 1
+    step = max_nodes - 1
+    for way_ref in list(uniqueways_ref):
+        line = uniqueways_ref[way_ref]
+        if len(line.coords) <= max_nodes:
+            continue
+        coords = list(line.coords)
+        pieces = [coords[i:i + max_nodes] for i in range(0, len(coords) - 1, step)]
+        uniqueways_ref[way_ref] = LineString(pieces[0])
+        parts[way_ref] = [way_ref]
+        for piece in pieces[1:]:
+            uniqueways_ref[next_ref] = LineString(piece)
+            parts[way_ref].append(next_ref)
+            next_ref += 1
+    return parts
+
+
+#Replaces in the relations every way split by its parts, with the same role
+def replaceSplitWays(allrelations,parts):
+    for all_relations_level in allrelations.values():
+        for rel in all_relations_level.values():
+            ways = rel["ways"]
+            if not any(way_ref in parts for way_ref in ways):
+                continue
+            roles = memberRoles(rel)
+            rel["ways"] = [part for way_ref in ways for part in parts.get(way_ref, (way_ref,))]
+            rel["roles"] = [role for way_ref, role in zip(ways, roles) for part in parts.get(way_ref, (way_ref,))]
+
+
+#The tags of a relation, in the order they are written
+def relationTags(level,rel):
+    #In case the name is all capital letters, here you can convert it
+    name = rel["boundaryname"].title()
+    return [
+        ("boundary", "administrative"),
+        ("admin_level", level),
+        ("type", "boundary"),
+        ("sourceTool", "SHPtoOSMBoundaries v0.2"),
+        #("natural", "water"),
+        ("ID", rel["identif"]),
+        ("name", name),
+    ]
+
+
+#The roles of the ways of a relation, given by the rings assembly, or all outer
+def memberRoles(rel):
+    return rel.get("roles") or ["outer"] * len(rel["ways"])
+
+
+#Writes the .osm file element by element while going through the ways, nodes and relations,
+#instead of building the whole XML tree in memory first. A .pbf output_filename is written by savePbf.
+def save(uniqueways_ref,node_registry,allrelations,output_filename,buffer_size=None):
+    if output_filename.endswith(".pbf"):
+        savePbf(uniqueways_ref,node_registry,allrelations,output_filename)
+        return
+    print("Saving to",output_filename)
+    file_out = openOutput(output_filename,buffer_size)
+    file_out.write('<osm version="0.6" upload="true" generator="JOSM">\n')
 
     #Creating the ways part in the .osm
-    #print uniqueways_ref
     print("Saving Ways")
     for way_ref,line in uniqueways_ref.items():
-        #way_ref = feature['properties']["way_ref"]
-        xml_way = ET.Element('way',{'id':'-'+str(way_ref), 'visible':'true'})
-        #points =  feature["geometry"]["coordinates"]
-        for p in line.coords:
-            node_id = getUniqueNodeId(p)
-            xml_way.append(ET.Element('nd',{'ref':str(node_id)}))
-        r.append(xml_way)
-    
+        nds = "".join(['<nd ref="%d" />' % node_registry.getUniqueNodeId(p) for p in line.coords])
+        file_out.write('<way id="-%s" visible="true">%s</way>' % (way_ref, nds))
+
     print("Saving Nodes")
-    for lonlat , n_id in unique_nodes.items():
-        lon = lonlat.split(",")[0]
-        lat = lonlat.split(",")[1]
-        xml_node = ET.Element('node',{'id':str(n_id), 'visible':'true','lat':str(lat) ,'lon':str(lon)})
-        xml_node
-        r.append(xml_node)
-    
-#Printing the XML for debug purpose with pretty format
-#xmlstr = minidom.parseString(ET.tostring(r)).toprettyxml(indent="   ")
-#with open(output_filename, "w") as f:
-   #f.write(xmlstr)
-    
+    for n_id, lon, lat in node_registry.nodes():
+        file_out.write('<node id="%d" visible="true" lat="%r" lon="%r" />' % (n_id, lat, lon))
+
     print("Saving Relations")
     counter = 1000000
     for level, all_relations_level in allrelations.items():
@@ -133,226 +520,696 @@ def save(uniqueways_ref,unique_nodes,allrelations,output_filename):
         
         for code, rel in all_relations_level.items():
                 ways = rel["ways"]
-                #print len(ways)
-                #print code
-                xml = ET.Element('relation',{'id':'-'+str(counter), 'visible':'true'})
-                #In case the name is all capital letters, here you can convert it
-                name = rel["boundaryname"].title()
-                identif = rel["identif"]
-                xml.append(ET.Element('tag',{'k':'boundary','v':'administrative'}))
-                xml.append(ET.Element('tag',{'k':'admin_level','v':level}))
-                xml.append(ET.Element('tag',{'k':'type','v':'boundary'}))
-                xml.append(ET.Element('tag',{'k':'sourceTool','v':'SHPtoOSMBoundaries v0.2'}))
-                #xml.append(ET.Element('tag',{'k':'natural','v':'water'}))
-                xml.append(ET.Element('tag',{'k':'ID','v':str(identif)}))
-                xml.append(ET.Element('tag',{'k':'name','v':name}))
+                xml = ['<relation id="-%d" visible="true">' % counter]
+                for k, v in relationTags(level,rel):
+                    xml.append('<tag k="%s" v="%s" />' % (k, escapeAttrib(v)))
                 
-                for way_ref in ways:
-                    #way_ref = indexes[1:indexes.find(',')] +  indexes[indexes.find(',')+2:] #we remove the , comma
-                    xml.append(ET.Element('member',{'type':'way','role':'outer','ref':'-'+str(way_ref)}))
-                r.append(xml)
+                for way_ref, role in zip(ways, memberRoles(rel)):
+                    xml.append('<member type="way" role="%s" ref="-%s" />' % (role, way_ref))
+                xml.append('</relation>')
+                file_out.write("".join(xml))
                 counter += 1
 
-    print("Saving to",output_filename)
-    file_out = open(output_filename, "wb")
-    file_out.write(ET.tostring(r, encoding='utf-8')) 
+    file_out.write('</osm>')
     file_out.close()
+
+
+#Writes the same elements as save in the binary OSM PBF format, the nodes first, then the ways and the relations.
+#The coordinates are written as the fixed-point integers of the node registry, with the granularity of their precision.
+def savePbf(uniqueways_ref,node_registry,allrelations,output_filename):
+    print("Saving to",output_filename)
+    #The node ids of the ways are given before writing the nodes, as in save
+    ways = []
+    for way_ref,line in uniqueways_ref.items():
+        ways.append((-way_ref, [node_registry.getUniqueNodeId(p) for p in line.coords], []))
+
+    lons = np.frombuffer(node_registry.lons, dtype=np.int64)
+    lats = np.frombuffer(node_registry.lats, dtype=np.int64)
+    if node_registry.precision <= 9:
+        granularity = 10 ** (9 - node_registry.precision)
+    else:
+        granularity = 1
+        lons = np.round(lons / 10 ** (node_registry.precision - 9)).astype(np.int64)
+        lats = np.round(lats / 10 ** (node_registry.precision - 9)).astype(np.int64)
+
+    writer = PBFWriter(output_filename, granularity)
+    if len(node_registry):
+        writer.writeHeader((lons.min() * granularity / 1e9, lats.min() * granularity / 1e9, lons.max() * granularity / 1e9, lats.max() * granularity / 1e9))
+    else:
+        writer.writeHeader()
+    print("Saving Nodes")
+    writer.writeNodes(-2 - np.arange(len(node_registry), dtype=np.int64), lats, lons)
+    print("Saving Ways")
+    writer.writeWays(ways)
+
+    print("Saving Relations")
+    relations = []
+    counter = 1000000
+    for level, all_relations_level in allrelations.items():
+        print("Export relations level",level)
+        print(len(all_relations_level))
+        for code, rel in all_relations_level.items():
+            relations.append((-counter, relationTags(level,rel), [("way", -way_ref, role) for way_ref, role in zip(rel["ways"], memberRoles(rel))]))
+            counter += 1
+    writer.writeRelations(relations)
+    writer.close()
  
-def addWayToRelation(level,identif,boundaryname,way_ref):
-    if identif in relations[level]:
-                relations[level][identif]["ways"].append(way_ref)
-    else: 
-                relations[level][identif] = {"boundaryname":boundaryname, "identif":identif, "ways":[way_ref]}
+#Building once an STRtree over the polygons boundaries, so every way is only tested against
+#the polygons whose bounding box intersects it. The exact within test is done with prepared geometries.
+def buildLevelIndex(level_ways):
+    codes = list(level_ways.keys())
+    geometries = [level_ways[code]["geometry"] for code in codes]
+    return {"codes": codes, "tree": STRtree(geometries), "prepared": [prep(g) for g in geometries]}
+
 
+#The relations of a way only depend on the way and on the polygons whose bounding box intersects it,
+#so its cached result is valid while none of them changes
+def polygonHashes(level_ways):
+    return [hashParts(code, level_ways[code]["geometry"].wkb) for code in level_ways]
 
-#We loop each of the unique splitted ways trough the boundaries for all the levels
-def detect_relations(way,way_ref,level,level_ways):
-    total_founds = 0
 
+def wayRelationsKey(way,level_index,polygon_hashes):
+    candidates = [polygon_hashes[i] for i in sorted(level_index["tree"].query(way))]
+    return hashParts(way.wkb, *candidates)
+
+
+#Both searches return the codes of the (at most two) polygons containing the way, in the level_ways order
+def findPolygonsBruteForce(way,level_ways):
+    founds = []
     for code,way_with_tags in level_ways.items():
-        #boundaryname = way_with_tags["properties"][DEEPER_LEVEL["nametag"]]
-        #print boundaryname
         if way.within(way_with_tags["geometry"]):
-            #print "Found within"
+            founds.append(code)
+            if len(founds) == 2:
+                break
+    return founds
+
+
+def findPolygonsIndexed(way,level_index):
+    founds = []
+    #Indexes follow the level_ways order, sorting them keeps the same result as the brute-force search
+    for i in sorted(level_index["tree"].query(way)):
+        if level_index["prepared"][i].contains(way):
+            founds.append(level_index["codes"][i])
+            if len(founds) == 2:
+                break
+    return founds
+
+
+def findPolygons(way,way_ref,level_ways,level_index=None,check_spatial_index=False):
+    if level_index is None:
+        return findPolygonsBruteForce(way,level_ways)
+    founds = findPolygonsIndexed(way,level_index)
+    if check_spatial_index:
+        brute_founds = findPolygonsBruteForce(way,level_ways)
+        if brute_founds != founds:
+            print("Spatial index mismatch for way",way_ref,"indexed:",founds,"brute-force:",brute_founds)
+    return founds
+
+
+#With several jobs, the worker processes only search the polygons of their chunk of ways, since every way
+#is independent. The main process adds the results to the relations in the way_ref order, so the
+#relations are the same as with a single job.
+worker_level = {}
+
+def initRelationsWorker(level_ways,spatial_index,check_spatial_index):
+    worker_level["ways"] = level_ways
+    worker_level["index"] = None
+    worker_level["check"] = check_spatial_index
+    if spatial_index or check_spatial_index:
+        worker_level["index"] = buildLevelIndex(level_ways)
+
+
+def findPolygonsChunk(chunk):
+    return [(way_ref, findPolygons(way,way_ref,worker_level["ways"],worker_level["index"],worker_level["check"])) for way_ref,way in chunk]
+
+
+#Every tile removes the overlapping ways of its home ways and searches the polygons of the ones kept,
+#as it's done for the whole splitted ways, with the ways and the polygons passing through the tile
+worker_tiles = {}
+
+def initTileWorker(tiles_dir,spatial_index,check_spatial_index):
+    worker_tiles["files"] = TileFiles(tiles_dir)
+    worker_tiles["spatial_index"] = spatial_index
+    worker_tiles["check"] = check_spatial_index
+
+
+#Returns the (index, coordinates, founds) of the home ways of the tile kept, and the ways removed
+def processTile(tile):
+    files = worker_tiles["files"]
+    indexes = []
+    ways = []
+    home = []
+    for index,coords,is_home in files.read(("ways",) + tile):
+        indexes.append(index)
+        ways.append(LineString(coords))
+        home.append(is_home)
+    kept,exact_duplicates,contained_ways = removeOverlappingTileWays(ways,home)
+
+    level_ways = {}
+    for code,rings in files.read(("polygons",) + tile):
+        level_ways[code] = {"geometry": MultiLineString([LineString(ring) for ring in rings])}
+    level_index = None
+    if level_ways and (worker_tiles["spatial_index"] or worker_tiles["check"]):
+        level_index = buildLevelIndex(level_ways)
+    tile_ways = [(indexes[i], np.asarray(ways[i].coords), findPolygons(ways[i],indexes[i],level_ways,level_index,worker_tiles["check"])) for i in kept]
+    return tile_ways,exact_duplicates,contained_ways
+
+
+#Dissolves the deeper level polygons into the boundaries of an upper level, without any geometry operation.
+#The polygons are grouped by the uniquetag of the level, and each group gets the ways that are in only one
+#of its polygons: a way between two polygons of the same upper boundary is inside it, and it cancels out
+#in the symmetric difference of their ways. child_relations are the deeper level relations by identif.
+def upperLevelRelations(child_relations,level_ways,level):
+    parent_ways = {}
+    boundarynames = {}
+    for code, way_with_tags in level_ways.items():
+        properties = way_with_tags["properties"]
+        boundary_id = properties[level["uniquetag"]]
+        boundarynames[boundary_id] = properties[level["nametag"]]
+        if code in child_relations:
+            parent_ways.setdefault(boundary_id, set()).symmetric_difference_update(child_relations[code]["ways"])
+    #In the order of their first way, as the ways were added before
+    relations = {}
+    for boundary_id in sorted((b for b in parent_ways if parent_ways[b]), key=lambda b: min(parent_ways[b])):
+        relations[boundary_id] = {"boundaryname": boundarynames[boundary_id], "identif": boundary_id, "ways": sorted(parent_ways[boundary_id])}
+    return relations
+
+
+#One conversion with its own relations and nodes, so a long-lived process can run many of them,
+#one after the other, with different settings:
+#
+#   BoundaryConverter(ConverterConfig(shapefile='fiji.shp', output_osm='fiji.osm')).run()
+class BoundaryConverter(object):
+    #hooks are called with the measure of every stage, see instrumentation.py
+    def __init__(self, config=None, hooks=None):
+        self.config = config or ConverterConfig()
+        self.instrumentation = Instrumentation(self.config.metrics_file, hooks, self.config.profile)
+        deeper_level_num = self.config.deeper_level["level"]
+        self.all_levels_num = [deeper_level_num]
+        self.relations = {}
+        for l in self.config.other_levels:
+            n = l["level"]
+            self.all_levels_num.append(n)
+        for n in self.all_levels_num:
+            self.relations[n] = dict()
+        self.node_registry = NodeRegistry(self.config.coordinates_precision)
+        self.cache = None
+        if self.config.cache_dir:
+            self.cache = StageCache(self.config.cache_dir, self.config.cache_max_size)
+
+    #Hash of the files a stage reads, the shapefile or the GeoJSON given
+    def inputHash(self,geojson):
+        shapefile = self.config.shapefile
+        if shapefile:
+            basename = os.path.splitext(shapefile)[0]
+            return hashParts(*[hashFile(basename + ext) for ext in (".shp", ".dbf", ".cpg") if os.path.exists(basename + ext)])
+        return hashFile(geojson)
+
+    #Returns the output of the stage from the cache, or computes it and stores it
+    def cached(self,stage,key_parts,compute):
+        if not self.cache:
+            return compute()
+        key = hashParts(stage, *key_parts)
+        value = self.cache.get(key)
+        if value is None:
+            value = compute()
+            self.cache.put(key, value)
+        else:
+            print("Loaded",stage,"from the cache")
+        return value
+
+    def addWayToRelation(self,level,identif,boundaryname,way_ref):
+        relations = self.relations
+        if identif in relations[level]:
+            relations[level][identif]["ways"].append(way_ref)
+        else: 
+            relations[level][identif] = {"boundaryname":boundaryname, "identif":identif, "ways":[way_ref]}
+
+    #Adds the way to the relations of the polygons found for it
+    def addFoundRelations(self,way_ref,founds,level_ways):
+        deeper_level = self.config.deeper_level
+        for code in founds:
+            way_with_tags = level_ways[code]
             
-            deeperlevel_uniquetag = DEEPER_LEVEL["uniquetag"]
-            deeperlevel_nametag =  DEEPER_LEVEL["nametag"]
-            deeper_level_num = DEEPER_LEVEL["level"]
-            #print deeper_level_num,deeperlevel_nametag,deeperlevel_uniquetag
+            deeperlevel_uniquetag = deeper_level["uniquetag"]
+            deeperlevel_nametag =  deeper_level["nametag"]
+            deeper_level_num = deeper_level["level"]
             boundaryname = way_with_tags["properties"][deeperlevel_nametag]
             identif =  way_with_tags["properties"][deeperlevel_uniquetag]
-            addWayToRelation(str(deeper_level_num),identif,boundaryname,way_ref)
-            
-            for eachlevel in OTHER_LEVELS:
-                
-                eachlevel_uniquetag = eachlevel["uniquetag"]
-                eachlevel_nametag =  eachlevel["nametag"]
-                eachlevel_num = eachlevel["level"]
-                boundary_id = way_with_tags["properties"][eachlevel_uniquetag]
-                boundarynames[eachlevel_num][boundary_id] = way_with_tags["properties"][eachlevel_nametag]
-                #In the next FOR loop, we will see if this way is a border between two upper level if the tags differ
-                if way_ref in upper_rel[eachlevel_num]:
-                    upper_rel[eachlevel_num][way_ref].append(boundary_id)
+            self.addWayToRelation(str(deeper_level_num),identif,boundaryname,way_ref)
+
+    def searchPolygonsParallel(self,items,level_ways,jobs):
+        chunk_size = max(1, len(items) // (jobs * 4))
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        init_args = (level_ways,self.config.spatial_index,self.config.check_spatial_index)
+        with multiprocessing.Pool(jobs, initRelationsWorker, init_args) as pool:
+            for chunk_founds in pool.imap(findPolygonsChunk, chunks):
+                for way_ref,founds in chunk_founds:
+                    yield way_ref,founds
+                print(way_ref)
+
+    #Searches the polygons of every way, taking from the cache the ways whose polygons did not change,
+    #and then adds the ways to the relations in the way_ref order
+    def detectRelations(self,uniqueways_ref,level_ways):
+        with self.instrumentation.stage("relations") as counters:
+            self.searchRelations(uniqueways_ref,level_ways,counters)
+
+    def searchRelations(self,uniqueways_ref,level_ways,counters):
+        config = self.config
+        level_index = None
+        if config.spatial_index or config.check_spatial_index or self.cache:
+            level_index = buildLevelIndex(level_ways)
+        search_index = level_index if config.spatial_index or config.check_spatial_index else None
+
+        founds_by_ref = {}
+        pending = list(uniqueways_ref.items())
+        if self.cache:
+            memo_key = hashParts("relations", config.deeper_level["uniquetag"], config.coordinates_precision)
+            memo = self.cache.get(memo_key) or {}
+            polygon_hashes = polygonHashes(level_ways)
+            way_keys = {}
+            missing = []
+            for way_ref,way in pending:
+                key = wayRelationsKey(way,level_index,polygon_hashes)
+                way_keys[way_ref] = key
+                if key in memo:
+                    founds_by_ref[way_ref] = memo[key]
                 else:
-                    upper_rel[eachlevel_num][way_ref] = [boundary_id]
-            
-            total_founds += 1
-            if total_founds == 2:
-                break
-    
-    
+                    missing.append((way_ref,way))
+            print("Ways with cached relations:",len(pending) - len(missing),"to search:",len(missing))
+            counters["cached_ways"] = len(pending) - len(missing)
+            pending = missing
+        counters["ways"] = len(uniqueways_ref)
+        counters["searched_ways"] = len(pending)
 
+        if config.jobs > 1 and pending:
+            print("Detecting relations with",config.jobs,"jobs")
+            founds_by_ref.update(self.searchPolygonsParallel(pending,level_ways,config.jobs))
+        else:
+            for way_ref,way in pending:
+                founds_by_ref[way_ref] = findPolygons(way,way_ref,level_ways,search_index,config.check_spatial_index)
+                if way_ref % 100 == 0:
+                    print(way_ref)
 
-####EXPORTING TO THE XML######
+        if self.cache:
+            self.cache.put(memo_key, {way_keys[way_ref]: founds for way_ref,founds in founds_by_ref.items()})
 
+        for way_ref in uniqueways_ref:
+            self.addFoundRelations(way_ref,founds_by_ref[way_ref],level_ways)
 
-#print 'Erase all nodes from the XML tree'
-##for i in r.findall("node"):
-    ##r.remove(i)
+    #The upper level relations are built from the deeper level ones, once all the ways are in them
+    def addUpperLevelRelations(self,level_ways):
+        with self.instrumentation.stage("upperLevelRelations") as counters:
+            counters["levels"] = len(self.config.other_levels)
+            child_ways = self.relations[str(self.config.deeper_level["level"])]
+            for eachlevel in self.config.other_levels:
+                self.relations[eachlevel["level"]] = upperLevelRelations(child_ways,level_ways,eachlevel)
+            counters["relations"] = sum(len(self.relations[eachlevel["level"]]) for eachlevel in self.config.other_levels)
 
-##print 'Erase all the ways from the XML Tree'
-##for way in r.findall("way"):
-    ##r.remove(way)
+    #Simplifies the ways once their relations are known, the polygons are searched with the original ways
+    def simplifyWays(self,uniqueways_ref):
+        with self.instrumentation.stage("simplify") as counters:
+            ways = {way_ref: list(line.coords) for way_ref,line in uniqueways_ref.items()}
+            counters["vertices"] = sum(len(coords) for coords in ways.values())
+            for way_ref,coords in simplifyWays(ways,self.config.simplify_tolerance).items():
+                uniqueways_ref[way_ref] = LineString(coords)
+            counters["simplified_vertices"] = sum(len(line.coords) for line in uniqueways_ref.values())
+            #The node ids are given again while saving, so the vertices removed are not written
+            self.node_registry = NodeRegistry(self.config.coordinates_precision)
+        print("Simplified the ways from",counters["vertices"],"to",counters["simplified_vertices"],"vertices")
 
-def main():
+    #Splits the ways over the node limit, updating the relations with the parts instead of searching them again
+    def splitLongWays(self,uniqueways_ref):
+        with self.instrumentation.stage("splitLongWays") as counters:
+            total_ways = len(uniqueways_ref)
+            parts = splitLongWays(uniqueways_ref,self.config.max_way_nodes)
+            replaceSplitWays(self.relations,parts)
+            counters["split_ways"] = len(parts)
+            counters["new_ways"] = len(uniqueways_ref) - total_ways
+        if parts:
+            print(len(parts),"ways over",self.config.max_way_nodes,"nodes split into",len(parts) + counters["new_ways"],"ways")
 
-    #We use the splitted geojson with all the 
-    with open(SPLITTED_WAYS_GEOJSON) as f:
-        data = json.load(f)
+    #Orders the ways of every relation along its rings and gives them their roles, reporting the open rings
+    def assembleRings(self,uniqueways_ref):
+        with self.instrumentation.stage("rings") as counters:
+            endpoints = {}
+            for way_ref,line in uniqueways_ref.items():
+                coords = line.coords
+                endpoints[way_ref] = (coords[0], coords[-1])
+            report = []
+            total_rings = 0
+            for level, all_relations_level in self.relations.items():
+                for identif, rel in all_relations_level.items():
+                    rings = ringRoles(assembleRings(rel["ways"],endpoints),uniqueways_ref)
+                    total_rings += len(rings)
+                    rel["ways"] = [way_ref for ring in rings for way_ref in ring["ways"]]
+                    rel["roles"] = [ring["role"] for ring in rings for way_ref in ring["ways"]]
+                    open_rings = [{"ways": ring["ways"], "ends": ring["ends"]} for ring in rings if not ring["closed"]]
+                    if open_rings:
+                        report.append({"level": level, "identif": identif, "name": rel["boundaryname"], "open_rings": open_rings})
+            if self.config.rings_report:
+                with open(self.config.rings_report, "w") as f:
+                    for line in report:
+                        f.write(json.dumps(line) + "\n")
+            print("Relations with open rings:",len(report))
+            counters["relations"] = sum(len(all_relations_level) for all_relations_level in self.relations.values())
+            counters["rings"] = total_rings
+            counters["open_relations"] = len(report)
 
+    def loadLevelWays(self):
+        config = self.config
+        key_parts = (self.inputHash(config.all_levels_geojson), config.deeper_level["uniquetag"], config.coordinates_precision)
+        return self.cached("levels", key_parts, self.readLevelWays)
 
-    print("Initial lines (), Total:",len(data['features']))
+    def readLevelWays(self):
+        rounding = {}
+        with self.instrumentation.stage("levels") as counters:
+            all_levels_ways = self.readLevelFeatures(rounding)
+            counters["polygons"] = len(all_levels_ways)
+        self.instrumentation.record("reduceFloat", source="levels", **rounding)
+        return all_levels_ways
 
-    count = 0
-    way_ref = 0
-    uniqueways = []
-    
+    def readLevelFeatures(self,rounding):
+        config = self.config
+        print("Loading ALL Levels file")
+        deeperlevel_uniquetag =  config.deeper_level["uniquetag"]
+        all_levels_ways = fillingLevelWays(self.levelFeatures(),deeperlevel_uniquetag,config.coordinates_precision,rounding)
+        print(len(all_levels_ways),"polygons found.")
+        return all_levels_ways
 
-    for feature in data['features']:
-        geom = feature['geometry']['coordinates']
-        if geom:
-            uniqueways.append(LineString(reduceFloat(geom)))
-            
+    #The ways are built while the features are read, rounding them in batches of read_batch_size
+    def loadSplittedWays(self):
+        rounding = {}
+        with self.instrumentation.stage("load") as counters:
+            uniqueways,counters["features"] = self.readSplittedWays(rounding)
+            counters["ways"] = len(uniqueways)
+        self.instrumentation.record("reduceFloat", source="splitted ways", **rounding)
+        return uniqueways
 
-    #print("After removing overlapping lines, Total:",len(uniqueways))
-
-    edgepoints_ocurrences = recalculateEdges(uniqueways)
-    print("Total way edges",len(edgepoints_ocurrences))
-    vertices = []
-    for point_id,ocurrence in edgepoints_ocurrences.items():
-        #if ocurrence > 2:
-            vertices.append(point_id)
-        #if ocurrence < 2:
-
-    print("Total vertices",len(vertices))
-    #print vertices
-
-    post_uniqueways = []
-    for way in uniqueways:
-        #print len(way.coords)
-        splitted = False
-        for n,coord in enumerate(way.coords):
-                if n != 0 and n != len(way.coords)-1:
-                    #print "searching"
-                    if getUniqueNodeId(coord) in vertices:
-                        print("Found vertice in middle of way, search in JOSM as ",coord[1]," ",coord[0])
-                        #print n
-                        #print way.coords[:n+1]
-                        way1 = LineString(way.coords[:n+1])
-                        #print way.coords[n:]
-                        way2 = LineString(way.coords[n:])
-                        post_uniqueways.append(way1)
-                        post_uniqueways.append(way2)
-                        splitted = True
-                        break
-        if not splitted:
-                post_uniqueways.append(way)
-
-    uniqueways = post_uniqueways
-    print("After splitting those ways, Total:",len(uniqueways))
-
-    post_uniqueways = []
-    for way in uniqueways:
-        repeated = False
-        if count % 100 == 0:
-            print(count)
-        count += 1
-        
-        for line in post_uniqueways:
-            if way.within(line):
-                repeated = True
-                break
-        if not repeated:
-            post_uniqueways.append(way)
+    def levelFeatures(self):
+        config = self.config
+        if config.shapefile:
+            return iterShapefileFeatures(config.shapefile)
+        return iterFeatures(config.all_levels_geojson,config.input_buffer_size)
 
-    uniqueways = post_uniqueways
-    print("After removing overlapping lines, Total:",len(uniqueways))
+    def readSplittedWays(self,rounding):
+        counts = {}
+        uniqueways = [LineString(coords) for coords in self.roundedSplittedWays(rounding,counts)]
+        print("Initial lines (), Total:",counts["features"])
+        return uniqueways,counts["features"]
 
+    #Yields the coordinates of every splitted way, counting the features read in counts
+    def roundedSplittedWays(self,rounding,counts):
+        config = self.config
+        counts["features"] = 0
+        geoms = []
+        if config.shapefile:
+            print("Computing the shared edges of",config.shapefile)
+            splitted_features = sharedEdgeFeatures(iterShapefileFeatures(config.shapefile),config.coordinates_precision,rounding)
+        else:
+            splitted_features = iterFeatures(config.splitted_ways_geojson,config.input_buffer_size)
+        for feature in splitted_features:
+            counts["features"] += 1
+            geom = feature['geometry']['coordinates']
+            if geom:
+                geoms.append(geom)
+            if len(geoms) == config.read_batch_size:
+                for coords in reduceFloatGeometries(geoms,config.coordinates_precision,rounding):
+                    yield coords
+                geoms = []
+        for coords in reduceFloatGeometries(geoms,config.coordinates_precision,rounding):
+            yield coords
 
-    #Joining the little segments within vertices
+    def save(self,uniqueways_ref,allrelations,output_filename):
+        with self.instrumentation.stage("save") as counters:
+            save(uniqueways_ref,self.node_registry,allrelations,output_filename,self.config.output_buffer_size)
+            counters["ways"] = len(uniqueways_ref)
+            counters["nodes"] = len(self.node_registry)
+            counters["relations"] = sum(len(all_relations_level) for all_relations_level in allrelations.values())
 
-    print("Recalculating Edge Points")
-    edgepoints_ocurrences = recalculateEdges(uniqueways)
-    print("Total way edges",len(edgepoints_ocurrences))
-    
-    
-    if MAINTENANCE:
+    def buildTopology(self,all_levels_ways,tolerance):
+        with self.instrumentation.stage("topology") as counters:
+            arcs = buildTopology(all_levels_ways,tolerance)
+            counters["arcs"] = len(arcs)
+        return arcs
+
+    def runTopology(self):
+        all_levels_ways = self.loadLevelWays()
+        print("Building the topology of the polygons")
         uniqueways_ref = {}
         way_ref = 1
+        #Half a unit of the coordinates rounding, as the rounded vertices next to each other are one unit apart
+        tolerance = 0.5 * 10.0 ** -self.config.coordinates_precision
+        key_parts = (polygonHashes(all_levels_ways),tolerance)
+        arcs = self.cached("topology", key_parts, lambda: self.buildTopology(all_levels_ways,tolerance))
+        for arc in arcs:
+            way_ref += 1
+            uniqueways_ref[way_ref] = LineString(arc["coords"])
+            self.addFoundRelations(way_ref,arcSides(arc),all_levels_ways)
+        print("Total boundary ways",len(uniqueways_ref))
+        self.finish(uniqueways_ref,all_levels_ways)
+
+    #Once the deeper level relations have all their ways, builds the upper levels and saves them all
+    def finish(self,uniqueways_ref,level_ways):
+        self.addUpperLevelRelations(level_ways)
+        if self.config.simplify_tolerance:
+            self.simplifyWays(uniqueways_ref)
+        if self.config.max_way_nodes:
+            self.splitLongWays(uniqueways_ref)
+        if self.config.assemble_rings:
+            self.assembleRings(uniqueways_ref)
+        self.save(uniqueways_ref,self.relations,self.config.output_osm)
+
+    def recalculateEdges(self,uniqueways):
+        with self.instrumentation.stage("recalculateEdges") as counters:
+            edgepoints_ocurrences = recalculateEdges(uniqueways,self.node_registry)
+            counters["ways"] = len(uniqueways)
+            counters["edge_points"] = len(edgepoints_ocurrences)
+        return edgepoints_ocurrences
+
+    #Splits the ways at the vertices and removes the overlapping ones
+    def cleanSplittedWays(self):
+        node_registry = self.node_registry
+
+        #We use the splitted geojson with all the 
+        uniqueways = self.loadSplittedWays()
+
+        edgepoints_ocurrences = self.recalculateEdges(uniqueways)
+        print("Total way edges",len(edgepoints_ocurrences))
+        #A set, so checking if a coordinate is a vertex doesn't scan all of them
+        vertices = set(edgepoints_ocurrences.keys())
+
+        print("Total vertices",len(vertices))
+
+        with self.instrumentation.stage("split") as counters:
+            counters["ways"] = len(uniqueways)
+            post_uniqueways = []
+            for way in uniqueways:
+                post_uniqueways.extend(splitWayAtVertices(way,vertices,node_registry))
+            counters["splitted_ways"] = len(post_uniqueways)
+
+        uniqueways = post_uniqueways
+        print("After splitting those ways, Total:",len(uniqueways))
+
+        with self.instrumentation.stage("dedup") as counters:
+            counters["ways"] = len(uniqueways)
+            uniqueways,exact_duplicates,contained_ways = removeOverlappingWays(uniqueways)
+            counters["exact_duplicates"] = exact_duplicates
+            counters["contained_ways"] = contained_ways
+        print("Exact duplicated ways removed:",exact_duplicates)
+        print("Ways within another way removed:",contained_ways)
+        print("After removing overlapping lines, Total:",len(uniqueways))
+
+
+        #Joining the little segments within vertices
+
+        print("Recalculating Edge Points")
+        edgepoints_ocurrences = self.recalculateEdges(uniqueways)
+        print("Total way edges",len(edgepoints_ocurrences))
+        return uniqueways,node_registry
+
+    def run(self):
+        config = self.config
+        if config.topology:
+            self.runTopology()
+            return
+        if config.tile_size and not config.maintenance:
+            self.runTiled()
+            return
+        key_parts = (self.inputHash(config.splitted_ways_geojson), config.coordinates_precision)
+        #The node ids given while cleaning the ways are cached with them, so the ids in the output are the same
+        uniqueways,self.node_registry = self.cached("splitted ways", key_parts, self.cleanSplittedWays)
+
+        if config.maintenance:
+            uniqueways_ref = {}
+            way_ref = 1
+            for way in uniqueways:
+                way_ref += 1
+                uniqueways_ref[way_ref] = way
+                if way_ref % 100 == 0:
+                    print(way_ref)
+                
+            self.save(uniqueways_ref,{},"tofix_splittedways.osm")
+            print("A maintenance 'tofix_splittedways.osm' file was generated in case further cleaning needs to be done with JOSM.")
+            print("Once finished, replace it as '",config.splitted_ways_geojson,"', set the MAINTENANCE setting to False and rerun this script.")
+            return
+    #####END OF CLEANING THE SPLITTED WAYS FILE
+       
+        all_levels_ways = self.loadLevelWays()
+
+        way_ref = 1          
+        uniqueways_ref = {}
         for way in uniqueways:
             way_ref += 1
             uniqueways_ref[way_ref] = way
-            if way_ref % 100 == 0:
-                print(way_ref)
-            
-        save(uniqueways_ref,unique_nodes,{},"tofix_splittedways.osm")
-        print("A maintenance 'tofix_splittedways.osm' file was generated in case further cleaning needs to be done with JOSM.")
-        print("Once finished, replace it as '",SPLITTED_WAYS_GEOJSON,"', set the MAINTENANCE setting to False and rerun this script.")
-        exit()
-#####END OF CLEANING THE SPLITTED WAYS FILE
-   
-    print("Loading ALL Levels file")
-    with open(ALL_LEVELS_GEOJSON) as f:
-        data = json.load(f)
-        
-    deeperlevel_uniquetag =  DEEPER_LEVEL["uniquetag"]
-    all_levels_ways = fillingLevelWays(data,deeperlevel_uniquetag)
-    print(len(all_levels_ways),"polygons found.")
-
-    way_ref = 1          
-    uniqueways_ref = {}
-    deeper_level_num = str(DEEPER_LEVEL["level"])
-    for way in uniqueways:
-        way_ref += 1
-        uniqueways_ref[way_ref] = way
-        detect_relations(way,way_ref,deeper_level_num,all_levels_ways)
-        if way_ref % 100 == 0:
-            print(way_ref)
-            
-    #If the way has the same upper boundaries in each side, we ignore it(NOT A BOUNDARY BORDER),
-    #otherwise, it is a border between boundary relation and we add it.
-    for level,way_refs in upper_rel.items():
-        for way_ref,uniqueidentifiers in way_refs.items():
-            if len(uniqueidentifiers) > 1:
-                if uniqueidentifiers[0] != uniqueidentifiers[1]:
-                    identif = uniqueidentifiers[0]
-                    boundaryname = boundarynames[level][identif]
-                    addWayToRelation(level,identif,boundaryname,way_ref)
-                    
-                    identif = uniqueidentifiers[1]
-                    boundaryname = boundarynames[level][identif]
-                    addWayToRelation(level,identif,boundaryname,way_ref)
-            else:
-                identif = uniqueidentifiers[0]
-                boundaryname = boundarynames[level][identif]
-                addWayToRelation(level,identif,boundaryname,way_ref)   
-    
-    #for level, all_relations_level in relations.items():
-        #print level
-        #print len(all_relations_level)
-        
-    save(uniqueways_ref,unique_nodes,relations,"final.osm")
+
+        self.detectRelations(uniqueways_ref,all_levels_ways)
+
+        self.finish(uniqueways_ref,all_levels_ways)
+
+    #Only the node ids, the properties of the polygons and the ways kept are in memory, the geometries
+    #of the splitted ways and of the polygons are read by the tiles from the tile files
+    def runTiled(self):
+        config = self.config
+        rounding = {}
+        if config.shapefile:
+            print("Warning: the shared edges of",config.shapefile,"are computed from all the polygons at once, before the tiles.")
+            print("The memory used is only limited by the tiles when the splitted ways are read from a GeoJSON file.")
+        with tempfile.TemporaryDirectory(prefix="boundaries_tiles_") as tiles_dir:
+            tile_files = TileFiles(tiles_dir,config.read_batch_size)
+            with self.instrumentation.stage("tiles") as counters:
+                vertices = self.spoolSplittedWays(tile_files,rounding,counters)
+                print("Total vertices",len(vertices))
+                tiles = self.partitionWays(tile_files,vertices,counters)
+                print("After splitting those ways, Total:",counters["splitted_ways"])
+                level_properties = self.partitionPolygons(tile_files,tiles,rounding,counters)
+                tile_files.flush()
+                counters["tiles"] = len(tiles)
+            self.instrumentation.record("reduceFloat", source="tiles", **rounding)
+            print(counters["splitted_ways"],"ways in",len(tiles),"tiles of",config.tile_size,"degrees")
+
+            ways = []
+            with self.instrumentation.stage("relations") as counters:
+                counters["exact_duplicates"] = 0
+                counters["contained_ways"] = 0
+                for tile_ways,exact_duplicates,contained_ways in self.processTiles(tiles_dir,tiles):
+                    ways.extend(tile_ways)
+                    counters["exact_duplicates"] += exact_duplicates
+                    counters["contained_ways"] += contained_ways
+                counters["tiles"] = len(tiles)
+                counters["ways"] = len(ways)
+        print("Exact duplicated ways removed:",counters["exact_duplicates"])
+        print("Ways within another way removed:",counters["contained_ways"])
+        print("After removing overlapping lines, Total:",len(ways))
+
+        #In the order of the splitted ways, the node ids were all given while splitting them
+        ways.sort(key=lambda way: way[0])
+        way_ref = 1
+        uniqueways_ref = {}
+        for index,coords,founds in ways:
+            way_ref += 1
+            uniqueways_ref[way_ref] = LineString(coords)
+            self.addFoundRelations(way_ref,founds,level_properties)
+        del ways
+
+        self.finish(uniqueways_ref,level_properties)
+
+    #Writes the rounded splitted ways to a file, to split them once all the vertices are known, and returns
+    #the node ids of the vertices. They are given first, as when cleaning the whole splitted ways.
+    def spoolSplittedWays(self,tile_files,rounding,counters):
+        node_registry = self.node_registry
+        vertices = set()
+        counts = {}
+        for coords in self.roundedSplittedWays(rounding,counts):
+            vertices.add(node_registry.getUniqueNodeId(coords[0]))
+            vertices.add(node_registry.getUniqueNodeId(coords[-1]))
+            tile_files.add(("splitted",), coords)
+        tile_files.flush()
+        counters["features"] = counts["features"]
+        return vertices
+
+    #Splits the ways at the vertices and writes them to all the tiles they pass through, numbered in the
+    #order of the splitted ways. Returns the home tiles of the ways.
+    def partitionWays(self,tile_files,vertices,counters):
+        tile_size = self.config.tile_size
+        tiles = set()
+        index = 0
+        for coords in tile_files.read(("splitted",)):
+            for way in splitWayAtVertices(LineString(coords),vertices,self.node_registry):
+                coords = np.asarray(way.coords)
+                home = homeTile(coords,tile_size)
+                tiles.add(home)
+                for tile in lineTiles(coords,tile_size):
+                    tile_files.add(("ways",) + tile, (index, coords, tile == home))
+                index += 1
+        counters["splitted_ways"] = index
+        return sorted(tiles)
+
+    #Writes every polygon to the tiles its rings pass through, only to the home tiles of the ways,
+    #and returns their properties
+    def partitionPolygons(self,tile_files,tiles,rounding,counters):
+        config = self.config
+        deeperlevel_uniquetag = config.deeper_level["uniquetag"]
+        tiles = set(tiles)
+        level_properties = {}
+        for feature in self.levelFeatures():
+            if not feature['properties']: continue
+            code = feature['properties'][deeperlevel_uniquetag]
+            level_properties[code] = {'properties': feature['properties']}
+            rings = reduceFloatGeometries([geom for i in feature['geometry']['coordinates'] for geom in i],config.coordinates_precision,rounding)
+            polygon_tiles = set()
+            for ring in rings:
+                polygon_tiles.update(lineTiles(ring,config.tile_size))
+            for tile in sorted(polygon_tiles & tiles):
+                tile_files.add(("polygons",) + tile, (code, rings))
+        counters["polygons"] = len(level_properties)
+        return level_properties
+
+    #Yields the result of every tile, processing the tiles in config.jobs processes
+    def processTiles(self,tiles_dir,tiles):
+        config = self.config
+        init_args = (tiles_dir,config.spatial_index,config.check_spatial_index)
+        if config.jobs > 1:
+            with multiprocessing.Pool(config.jobs, initTileWorker, init_args) as pool:
+                for tile,result in zip(tiles, pool.imap(processTile, tiles)):
+                    print("Tile",tile,"ways",len(result[0]))
+                    yield result
+        else:
+            initTileWorker(*init_args)
+            for tile in tiles:
+                result = processTile(tile)
+                print("Tile",tile,"ways",len(result[0]))
+                yield result
+
+
+#Runs one conversion, every setting given (by its ConverterConfig name) overrides the module setting
+def main(**settings):
+    BoundaryConverter(ConverterConfig(**settings)).run()
+
+
+#Command line entry point, every option overrides the module setting with the same name
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Converts the boundaries GeoJSON files into OSM boundary relations.")
+    parser.add_argument("--all-levels", dest="all_levels_geojson", help="GeoJSON with the deeper level polygons (default: %s)" % ALL_LEVELS_GEOJSON)
+    parser.add_argument("--splitted-ways", dest="splitted_ways_geojson", help="GeoJSON with the splitted ways (default: %s)" % SPLITTED_WAYS_GEOJSON)
+    parser.add_argument("--shapefile", help="read the deeper level polygons directly from this .shp file")
+    parser.add_argument("--topology", action="store_true", default=None, help="build the boundary ways from the shared edges of the polygons")
+    parser.add_argument("--maintenance", action="store_true", default=None, help="only generate the tofix_splittedways.osm file")
+    parser.add_argument("--output", dest="output_osm", help="the .osm file generated, .gz or .bz2 to compress it, or .pbf for the binary format (default: %s)" % OUTPUT_OSM)
+    parser.add_argument("--no-rings", dest="assemble_rings", action="store_false", default=None, help="don't assemble the ways of the relations into rings, write them all as outer")
+    parser.add_argument("--rings-report", help="write the relations with open rings to this JSON lines file")
+    parser.add_argument("--precision", dest="coordinates_precision", type=int, help="decimals kept in the coordinates, up to %d (default: %d)" % (NodeRegistry.MAX_PRECISION, COORDINATES_PRECISION))
+    parser.add_argument("--max-way-nodes", type=int, help="split the ways with more nodes than this (default: %d)" % MAX_WAY_NODES)
+    parser.add_argument("--simplify", dest="simplify_tolerance", type=float, help="simplify the ways with this tolerance in degrees, keeping their ends and junctions")
+    parser.add_argument("--jobs", type=int, help="number of processes used to detect the relations (default: %d)" % JOBS)
+    parser.add_argument("--tile-size", type=float, help="convert the splitted ways in square tiles of this size in degrees, to limit the memory used")
+    parser.add_argument("--cache-dir", help="directory where the result of every stage is cached between runs")
+    parser.add_argument("--metrics", dest="metrics_file", help="append the time, memory and counts of every stage to this JSON lines file")
+    parser.add_argument("--profile", choices=("cprofile", "tracemalloc"), help="profile every stage with cProfile or tracemalloc")
+    args = parser.parse_args(argv)
+    settings = {name: value for name, value in vars(args).items() if value is not None}
+    main(**settings)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -0,0 +1,110 @@
+"""
+Checks that the tiled conversion (--tile-size) writes the same .osm file as the conversion of the whole
+splitted ways, for a synthetic grid (see synthetic.py) and for small cases of ways crossing the tile
+edges, with several tile sizes:
+
+$ python benchmarks/check_tiles.py
+$ python benchmarks/check_tiles.py --jobs 4
+"""
+import argparse
+import contextlib
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import SHPtoOSMBoundaries as shp
+from synthetic import SyntheticBoundaries
+
+
+def rectangle(tid, name, minx, miny, maxx, maxy):
+    ring = [[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]
+    return {
+        'type': 'Feature',
+        'properties': {'TID': tid, 'TIKINA': name, 'PID': 1, 'PROVINCE': 'PROVINCE 1'},
+        'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring]]},
+    }
+
+
+def write_case(workdir, polygons, ways):
+    all_levels = os.path.join(workdir, 'level8.geojson')
+    splitted = os.path.join(workdir, 'splitted.geojson')
+    with open(all_levels, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': polygons}, f)
+    with open(splitted, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'LineString', 'coordinates': way}} for way in ways
+        ]}, f)
+    return all_levels, splitted
+
+
+def contained_way_in_another_tile(workdir):
+    """
+    The short way is within the border of A and B, whose only segment is in another tile, and it's removed
+    as the reversed copy of the border is. The way only partly over the border is kept.
+    """
+    polygons = [rectangle(1, 'A', 0, 0, 2, 1), rectangle(2, 'B', 0, -1, 2, 0)]
+    ways = [
+        [[0, 0], [0, 1], [2, 1], [2, 0]],
+        [[0, 0], [0, -1], [2, -1], [2, 0]],
+        [[0, 0], [2, 0]],
+        [[1.5, 0], [1.9, 0]],
+        [[2, 0], [0, 0]],
+        [[1.5, 0], [2.5, 0]],
+    ]
+    return write_case(workdir, polygons, ways)
+
+
+def synthetic_grid(workdir):
+    all_levels = os.path.join(workdir, 'level8.geojson')
+    splitted = os.path.join(workdir, 'splitted.geojson')
+    SyntheticBoundaries(12).write(all_levels, splitted)
+    return all_levels, splitted
+
+
+#Every case with the tile sizes it's converted with
+CASES = [
+    (contained_way_in_another_tile, [0.8, 0.3, 5]),
+    (synthetic_grid, [0.05, 0.013, 0.01, 0.005]),
+]
+
+
+def convert(all_levels, splitted, output, **settings):
+    config = shp.ConverterConfig(all_levels_geojson=all_levels, splitted_ways_geojson=splitted, output_osm=output, **settings)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        shp.BoundaryConverter(config).run()
+
+
+def check(jobs):
+    """
+    Returns the (case, tile size) whose tiled output is different.
+    """
+    failures = []
+    for make_case, tile_sizes in CASES:
+        workdir = tempfile.mkdtemp(prefix='boundaries_tiles_check_')
+        try:
+            all_levels, splitted = make_case(workdir)
+            expected = os.path.join(workdir, 'whole.osm')
+            convert(all_levels, splitted, expected)
+            for tile_size in tile_sizes:
+                output = os.path.join(workdir, 'tiled.osm')
+                convert(all_levels, splitted, output, tile_size=tile_size, jobs=jobs)
+                same = filecmp.cmp(expected, output, shallow=False)
+                print('%-32s %8s %s' % (make_case.__name__, tile_size, 'same' if same else 'DIFFERENT'))
+                if not same:
+                    failures.append((make_case.__name__, tile_size))
+        finally:
+            shutil.rmtree(workdir)
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the tiled conversion with the conversion of the whole splitted ways.')
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(1 if check(args.jobs) else 0)
@@ -0,0 +1,145 @@
+"""
+Benchmark suite of the boundaries conversion.
+
+For every grid size, generates synthetic boundaries (see synthetic.py), runs the SHPtoOSMBoundaries
+conversion timing each of its stages through the instrumentation hooks, and then times the
+updateBoundaryLevel pass over the generated .osm file. Every measure is appended as a JSON line to
+the results file, so the results of two commits can be compared:
+
+$ python benchmarks/run_benchmarks.py --sizes 10 20 40 --results before.jsonl
+$ python benchmarks/run_benchmarks.py --sizes 10 20 40 --results after.jsonl --compare before.jsonl
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import SHPtoOSMBoundaries as shp
+from synthetic import SyntheticBoundaries
+
+UPDATE_BOUNDARY_LEVELS = os.path.join(ROOT, 'updateBoundaryLevels')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_conversion(workdir, size, settings):
+    all_levels = os.path.join(workdir, 'level8.geojson')
+    splitted = os.path.join(workdir, 'splitted.geojson')
+    output = os.path.join(workdir, 'boundaries.osm')
+    SyntheticBoundaries(size).write(all_levels, splitted)
+
+    measures = []
+    config = shp.ConverterConfig(all_levels_geojson=all_levels, splitted_ways_geojson=splitted, output_osm=output, **settings)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        shp.BoundaryConverter(config, hooks=[measures.append]).run()
+    measures.append({'stage': 'total', 'wall_time': time.perf_counter() - start})
+    return measures, output
+
+
+def benchmark_update_levels(workdir, osm_filename):
+    """
+    updateBoundaryLevel.py reads boundaries.osm from the current directory, so it's run there.
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, os.path.join(UPDATE_BOUNDARY_LEVELS, 'updateBoundaryLevel.py')],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    measure = {'stage': 'updateBoundaryLevel', 'wall_time': time.perf_counter() - start}
+    if process.returncode != 0:
+        errors = process.stderr.decode('utf-8', 'replace').strip().splitlines()
+        measure['error'] = errors[-1] if errors else 'exit code %d' % process.returncode
+    return measure
+
+
+def measure_key(measure):
+    """
+    A stage can be measured several times in a conversion, like recalculateEdges, or once for every
+    source, like reduceFloat, so the measures are told apart by their source and their occurrence.
+    """
+    return measure['size'], measure['stage'], measure.get('source'), measure.get('occurrence', 0)
+
+
+def stage_label(measure):
+    label = measure['stage']
+    if measure.get('source'):
+        label += ' (%s)' % measure['source']
+    if measure.get('occurrence'):
+        label += ' #%d' % (measure['occurrence'] + 1)
+    return label
+
+
+def compare(results, baseline_filename):
+    """
+    Prints the time of every measure against the same one in the baseline results.
+    """
+    baseline = {}
+    with open(baseline_filename) as f:
+        for line in f:
+            measure = json.loads(line)
+            baseline[measure_key(measure)] = measure['wall_time']
+    print('%8s %34s %12s %12s %8s' % ('size', 'stage', 'baseline (s)', 'now (s)', 'ratio'))
+    for measure in results:
+        key = measure_key(measure)
+        if key in baseline and baseline[key] > 0:
+            print('%8d %34s %12.4f %12.4f %8.2f' % (measure['size'], stage_label(measure), baseline[key], measure['wall_time'], measure['wall_time'] / baseline[key]))
+
+
+def run(sizes, results_filename, settings, keep_dir=None):
+    revision = git_revision()
+    results = []
+    for size in sizes:
+        if keep_dir:
+            workdir = os.path.join(keep_dir, str(size))
+            os.makedirs(workdir, exist_ok=True)
+        else:
+            workdir = tempfile.mkdtemp(prefix='boundaries_bench_')
+        try:
+            measures, osm_filename = benchmark_conversion(workdir, size, settings)
+            measures.append(benchmark_update_levels(workdir, osm_filename))
+        finally:
+            if not keep_dir:
+                shutil.rmtree(workdir)
+        occurrences = {}
+        for measure in measures:
+            stage = measure['stage'], measure.get('source')
+            measure.update({'size': size, 'polygons': size * size, 'revision': revision, 'python': platform.python_version(), 'occurrence': occurrences.get(stage, 0)})
+            occurrences[stage] = measure['occurrence'] + 1
+            print('%8d %34s %10.4f s %s' % (size, stage_label(measure), measure['wall_time'], measure.get('error', '')))
+        results.extend(measures)
+    if results_filename:
+        with open(results_filename, 'a') as f:
+            for measure in results:
+                f.write(json.dumps(measure, sort_keys=True) + '\n')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times every stage of the boundaries conversion on synthetic grids.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20, 40], help='grid sizes, each one generates size x size polygons')
+    parser.add_argument('--results', default='bench_results.jsonl', help='JSON lines file where the measures are appended')
+    parser.add_argument('--compare', help='results file of a previous run to compare with')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--topology', action='store_true')
+    parser.add_argument('--tile-size', type=float, help='convert the splitted ways in tiles of this size in degrees')
+    parser.add_argument('--keep-dir', help='generate and convert the files in this directory and keep them')
+    args = parser.parse_args()
+    results = run(args.sizes, args.results, {'jobs': args.jobs, 'topology': args.topology, 'tile_size': args.tile_size}, args.keep_dir)
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,84 @@
+"""
+Benchmark of the mid-way splitting pass of SHPtoOSMBoundaries.
+
+Builds synthetic chains of ways where every way has interior coordinates and some of them
+are junctions (edges of other ways), then times the splitting with the vertices stored in a
+list (the old linear scan) and in a set (splitWayAtVertices), for a growing number of vertices.
+
+$ python benchmarks/split_ways.py [max_vertices]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shapely.geometry import LineString
+
+import SHPtoOSMBoundaries as shp
+
+
+def synthetic_ways(num_ways, points_per_way=20):
+    """
+    Ways along a row of the grid. Every fifth way also has a short spur starting in one of its
+    interior coordinates, so that coordinate becomes a vertex in the middle of the way.
+    """
+    ways = []
+    for w in range(num_ways):
+        y = w * 0.001
+        coords = [(x * 0.0001, y) for x in range(points_per_way)]
+        ways.append(LineString(coords))
+        if w % 5 == 0:
+            middle = coords[points_per_way // 2]
+            ways.append(LineString([middle, (middle[0], y + 0.0005)]))
+    return ways
+
+
+def split_with_list(ways, vertices, node_registry):
+    vertices = list(vertices)
+    post_ways = []
+    for way in ways:
+        splitted = False
+        for n, coord in enumerate(way.coords):
+            if n != 0 and n != len(way.coords) - 1:
+                if node_registry.getUniqueNodeId(coord) in vertices:
+                    post_ways.append(LineString(way.coords[:n + 1]))
+                    post_ways.append(LineString(way.coords[n:]))
+                    splitted = True
+                    break
+        if not splitted:
+            post_ways.append(way)
+    return post_ways
+
+
+def split_with_set(ways, vertices, node_registry):
+    vertices = set(vertices)
+    post_ways = []
+    for way in ways:
+        post_ways.extend(shp.splitWayAtVertices(way, vertices, node_registry))
+    return post_ways
+
+
+def run(max_vertices):
+    print('%10s %10s %12s %12s' % ('ways', 'vertices', 'list (s)', 'set (s)'))
+    num_ways = 250
+    while True:
+        ways = synthetic_ways(num_ways)
+        node_registry = shp.NodeRegistry()
+        vertices = shp.recalculateEdges(ways, node_registry)
+        if len(vertices) > max_vertices:
+            break
+        timings = []
+        for split in (split_with_list, split_with_set):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                split(ways, vertices, node_registry)
+                timings.append(time.perf_counter() - start)
+        print('%10d %10d %12.3f %12.3f' % (len(ways), len(vertices), timings[0], timings[1]))
+        num_ways *= 2
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
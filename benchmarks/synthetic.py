@@ -0,0 +1,107 @@
+"""
+Synthetic admin boundaries for the benchmarks.
+
+Generates a grid of deeper level polygons (TID/TIKINA) nested into provinces (PID/PROVINCE) of
+province_size x province_size cells, the tags of the default SHPtoOSMBoundaries settings. The interior
+grid nodes and the edge vertices are jittered, so the borders are irregular, but every vertex is shared
+by the polygons at both sides of the border, as in a topologically clean dataset. Jittered grids are used
+instead of Voronoi cells because the clipped Voronoi cells don't share their vertices exactly.
+
+The grid nodes move up to NODE_JITTER cells, so two borders meeting at a node make an angle of at least
+36 degrees. The edge vertices only move across their border, up to EDGE_JITTER times their distance
+to the nearest end, so a border stays within 9 degrees of the straight line between its ends and no
+borders cross. Every polygon generated is checked to be valid.
+
+Writes the all levels GeoJSON and the splitted ways GeoJSON (every border once, as the GRASS break makes it):
+
+$ python benchmarks/synthetic.py 40 level8.geojson splitted.geojson
+"""
+import json
+import random
+import math
+import sys
+
+from shapely.geometry import Polygon
+
+ORIGIN = (177.5, -18.5)
+CELL_SIZE = 0.01
+NODE_JITTER = 0.25
+EDGE_JITTER = 0.15
+
+
+class SyntheticBoundaries(object):
+    """
+    A size x size grid of polygons, with points_per_edge vertices between two grid nodes.
+    """
+    def __init__(self, size, province_size=4, points_per_edge=8, seed=1):
+        self.size = size
+        self.province_size = province_size
+        self.points_per_edge = points_per_edge
+        self.random = random.Random(seed)
+        self.nodes = {}
+        for i in range(size + 1):
+            for j in range(size + 1):
+                self.nodes[i, j] = self.jitter(i, j, NODE_JITTER if 0 < i < size and 0 < j < size else 0)
+        self.edges = {}
+
+    def jitter(self, x, y, amount):
+        return (
+            round(ORIGIN[0] + (x + self.random.uniform(-amount, amount)) * CELL_SIZE, 8),
+            round(ORIGIN[1] + (y + self.random.uniform(-amount, amount)) * CELL_SIZE, 8),
+        )
+
+    def edge(self, a, b):
+        """
+        Coordinates of the border from grid node a to grid node b, the same ones for both of its polygons.
+        """
+        key = (a, b) if a < b else (b, a)
+        if key not in self.edges:
+            (x1, y1), (x2, y2) = self.nodes[key[0]], self.nodes[key[1]]
+            border_of_grid = key[0][0] == key[1][0] in (0, self.size) or key[0][1] == key[1][1] in (0, self.size)
+            amount = 0 if border_of_grid else EDGE_JITTER
+            length = math.hypot(x2 - x1, y2 - y1)
+            #The unit vector across the border
+            nx, ny = (y1 - y2) / length, (x2 - x1) / length
+            coords = [self.nodes[key[0]]]
+            for k in range(1, self.points_per_edge + 1):
+                t = k / (self.points_per_edge + 1.0)
+                offset = self.random.uniform(-amount, amount) * min(t, 1 - t) * length
+                coords.append((
+                    round(x1 + (x2 - x1) * t + nx * offset, 8),
+                    round(y1 + (y2 - y1) * t + ny * offset, 8),
+                ))
+            coords.append(self.nodes[key[1]])
+            self.edges[key] = coords
+        coords = self.edges[key]
+        return coords if key == (a, b) else coords[::-1]
+
+    def polygons(self):
+        for i in range(self.size):
+            for j in range(self.size):
+                corners = [(i, j), (i + 1, j), (i + 1, j + 1), (i, j + 1), (i, j)]
+                ring = []
+                for a, b in zip(corners, corners[1:]):
+                    ring.extend(self.edge(a, b)[:-1])
+                ring.append(ring[0])
+                assert Polygon(ring).is_valid, 'the polygon of the cell %d %d is not valid' % (i, j)
+                pid = (i // self.province_size) * 1000 + j // self.province_size
+                yield {
+                    'type': 'Feature',
+                    'properties': {'TID': i * 100000 + j, 'TIKINA': 'TIKINA %d %d' % (i, j), 'PID': pid, 'PROVINCE': 'PROVINCE %d' % pid},
+                    'geometry': {'type': 'MultiPolygon', 'coordinates': [[[list(p) for p in ring]]]},
+                }
+
+    def splitted_ways(self):
+        list(self.polygons())
+        for coords in self.edges.values():
+            yield {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'LineString', 'coordinates': [list(p) for p in coords]}}
+
+    def write(self, all_levels_filename, splitted_ways_filename):
+        with open(all_levels_filename, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': list(self.polygons())}, f)
+        with open(splitted_ways_filename, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': list(self.splitted_ways())}, f)
+
+
+if __name__ == '__main__':
+    SyntheticBoundaries(int(sys.argv[1])).write(sys.argv[2], sys.argv[3])
@@ -0,0 +1,83 @@
+#Measures the stages of a conversion: wall time, peak memory and item counts of every stage.
+#Each measure is a dict passed to the hooks (any callable) and written as a JSON line to the metrics file.
+#With profile='cprofile' every stage is profiled into profile_<stage>.prof (profile_<stage>_2.prof and so on
+#for the stages measured again in the same conversion, like recalculateEdges), and with
+#profile='tracemalloc' the peak of the Python allocations inside every stage is added to its measure.
+from contextlib import contextmanager
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  #Not available on Windows
+    resource = None
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+
+#Peak resident memory of the process so far, in kilobytes
+def peakRss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  #macOS reports it in bytes
+        peak //= 1024
+    return peak
+
+
+class Instrumentation(object):
+    def __init__(self, metrics_file=None, hooks=None, profile=None):
+        if profile is not None and profile not in PROFILE_MODES:
+            raise ValueError('Unknown profile mode %r, use one of %s' % (profile, ', '.join(PROFILE_MODES)))
+        self.metrics_file = metrics_file
+        self.hooks = list(hooks or [])
+        self.profile = profile
+        self.measures = []
+        #Times every stage was measured, so the profiles of a repeated stage don't overwrite each other
+        self.stage_counts = {}
+
+    def record(self, stage, **values):
+        measure = {'stage': stage}
+        measure.update(values)
+        self.measures.append(measure)
+        for hook in self.hooks:
+            hook(measure)
+        if self.metrics_file:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps(measure, sort_keys=True) + '\n')
+        return measure
+
+    #Measures the code inside the with block. The counters dict it gives is added to the measure,
+    #so the stage can count its items there:
+    #
+    #   with instrumentation.stage('split') as counters:
+    #       counters['ways'] = len(ways)
+    @contextmanager
+    def stage(self, name):
+        counters = {}
+        occurrence = self.stage_counts.get(name, 0)
+        self.stage_counts[name] = occurrence + 1
+        profiler = None
+        if self.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profile == 'tracemalloc':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            values = {'wall_time': time.perf_counter() - start, 'peak_rss_kb': peakRss()}
+            if profiler is not None:
+                profiler.disable()
+                values['profile_file'] = 'profile_%s.prof' % name if occurrence == 0 else 'profile_%s_%d.prof' % (name, occurrence + 1)
+                profiler.dump_stats(values['profile_file'])
+            elif self.profile == 'tracemalloc':
+                values['tracemalloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            values.update(counters)
+            self.record(name, **values)
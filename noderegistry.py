@@ -0,0 +1,42 @@
+#The nodes of a conversion. It's in its own module, not in SHPtoOSMBoundaries.py, so the registries
+#stored in the stage cache load the same when the script is run directly or imported as a library.
+from array import array
+
+
+#Keeps a negative id for each different coordinate, the first one being -2.
+#The coordinates are keyed by fixed-point integers at the reduceFloat precision, and stored
+#in arrays in the order the ids were given, so several conversions can run in the same process.
+#The fixed-point longitudes must fit in the signed 64 bits of the arrays, up to MAX_PRECISION decimals.
+class NodeRegistry(object):
+    MAX_PRECISION = 16
+
+    def __init__(self, precision=5):
+        if not 0 <= precision <= self.MAX_PRECISION:
+            raise ValueError("The coordinates precision must be between 0 and %d decimals, not %r" % (self.MAX_PRECISION, precision))
+        self.precision = precision
+        self.scale = 10 ** precision
+        self.indexes = {}
+        self.lons = array('q')
+        self.lats = array('q')
+
+    def __len__(self):
+        return len(self.lons)
+
+    def getUniqueNodeId(self, point):
+        lon = int(round(point[0] * self.scale))
+        lat = int(round(point[1] * self.scale))
+        #Both fixed-point values packed in one integer, the latitude in the lower 64 bits
+        key = (lon << 64) + lat + (1 << 63)
+        index = self.indexes.get(key)
+        if index is None:
+            index = len(self.lons)
+            self.indexes[key] = index
+            self.lons.append(lon)
+            self.lats.append(lat)
+        return -2 - index
+
+    #Yields (id, lon, lat) in the order the ids were given
+    def nodes(self):
+        scale = self.scale
+        for index in range(len(self.lons)):
+            yield -2 - index, self.lons[index] / scale, self.lats[index] / scale
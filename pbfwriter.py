@@ -0,0 +1,190 @@
+#Writes OSM PBF files (https://wiki.openstreetmap.org/wiki/PBF_Format) without any protobuf library.
+#The few protobuf messages of the format are encoded here: the nodes are written as dense nodes and
+#the ids, coordinates and node refs are delta encoded, the packed fields being encoded with NumPy.
+#Every block of up to BLOCK_SIZE elements is compressed with zlib.
+from itertools import chain
+import struct
+import zlib
+
+import numpy as np
+
+BLOCK_SIZE = 8000
+
+#Types of the relation members
+MEMBER_TYPES = {"node": 0, "way": 1, "relation": 2}
+
+
+def encodeVarint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+#For Python integers and NumPy int64 arrays
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def fieldKey(number, wire_type):
+    return encodeVarint((number << 3) | wire_type)
+
+
+def varintField(number, value):
+    return fieldKey(number, 0) + encodeVarint(value)
+
+
+def bytesField(number, data):
+    return fieldKey(number, 2) + encodeVarint(len(data)) + data
+
+
+#Varints of a whole array of non negative integers at once, with the number of bytes of each one
+def varintBytes(values):
+    values = np.asarray(values, dtype=np.uint64)
+    counts = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        counts += values >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(counts) - counts
+    out = np.zeros(int(counts.sum()), dtype=np.uint8)
+    for k in range(int(counts.max()) if len(values) else 0):
+        selected = counts > k
+        septets = (values[selected] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (counts[selected] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[selected] + k] = septets | more
+    return out.tobytes(), counts
+
+
+#Packed varints of small lists, like the string indexes of the tags, are faster without NumPy
+def packedVarints(values):
+    return b"".join([encodeVarint(value) for value in values])
+
+
+#Packed sint64 of the differences between consecutive values (the first one from 0)
+def packedDeltas(values):
+    values = np.asarray(values, dtype=np.int64)
+    deltas = np.diff(values, prepend=np.int64(0))
+    return varintBytes(zigzag(deltas).view(np.uint64))[0]
+
+
+#packedDeltas of many sequences, like the node refs of all the ways of a block, encoded at once
+def packedDeltasOfSequences(sequences):
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    values = np.fromiter(chain.from_iterable(sequences), dtype=np.int64, count=int(lengths.sum()))
+    deltas = np.diff(values, prepend=np.int64(0))
+    starts = np.cumsum(lengths) - lengths
+    first = starts[lengths > 0]
+    deltas[first] = values[first]
+    data, counts = varintBytes(zigzag(deltas).view(np.uint64))
+    byte_offsets = np.concatenate(([0], np.cumsum(counts)))
+    begins = byte_offsets[starts].tolist()
+    ends = byte_offsets[starts + lengths].tolist()
+    return [data[begin:end] for begin, end in zip(begins, ends)]
+
+
+def packedField(number, data):
+    return bytesField(number, data) if data else b""
+
+
+#The strings of a block, the index 0 is always the empty string
+class StringTable(object):
+    def __init__(self):
+        self.indexes = {"": 0}
+        self.strings = [""]
+
+    def index(self, string):
+        string = str(string)
+        index = self.indexes.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.indexes[string] = index
+            self.strings.append(string)
+        return index
+
+    def encode(self):
+        return b"".join(bytesField(1, s.encode("utf-8")) for s in self.strings)
+
+
+class PBFWriter(object):
+    #The coordinates are given as integers in units of granularity nanodegrees
+    def __init__(self, output_filename, granularity=100, writing_program="SHPtoOSMBoundaries v0.2"):
+        self.file_out = open(output_filename, "wb")
+        self.granularity = granularity
+        self.writing_program = writing_program
+
+    def writeBlob(self, blob_type, data):
+        blob = varintField(2, len(data)) + bytesField(3, zlib.compress(data))
+        header = bytesField(1, blob_type.encode("ascii")) + varintField(3, len(blob))
+        self.file_out.write(struct.pack("!I", len(header)))
+        self.file_out.write(header)
+        self.file_out.write(blob)
+
+    #bbox is (left, bottom, right, top) in degrees
+    def writeHeader(self, bbox=None):
+        data = b""
+        if bbox is not None:
+            left, bottom, right, top = [int(round(value * 1e9)) for value in bbox]
+            data += bytesField(1, b"".join(varintField(number, zigzag(value)) for number, value in ((1, left), (2, right), (3, top), (4, bottom))))
+        data += bytesField(4, b"OsmSchema-V0.6") + bytesField(4, b"DenseNodes")
+        data += bytesField(16, self.writing_program.encode("utf-8"))
+        self.writeBlob("OSMHeader", data)
+
+    def writeBlock(self, strings, group):
+        data = bytesField(1, strings.encode()) + bytesField(2, group)
+        if self.granularity != 100:
+            data += varintField(17, self.granularity)
+        self.writeBlob("OSMData", data)
+
+    #Nodes without tags, from the arrays of ids and integer coordinates
+    def writeNodes(self, ids, lats, lons):
+        for start in range(0, len(ids), BLOCK_SIZE):
+            end = start + BLOCK_SIZE
+            dense = packedField(1, packedDeltas(ids[start:end]))
+            dense += packedField(8, packedDeltas(lats[start:end]))
+            dense += packedField(9, packedDeltas(lons[start:end]))
+            self.writeBlock(StringTable(), bytesField(2, dense))
+
+    #ways is a sequence of (id, node refs, tags), the tags being a list of (key, value)
+    def writeWays(self, ways):
+        for block in self.blocks(ways):
+            strings = StringTable()
+            group = []
+            refs = packedDeltasOfSequences([way_refs for way_id, way_refs, tags in block])
+            for (way_id, way_refs, tags), packed_refs in zip(block, refs):
+                way = varintField(1, way_id & 0xffffffffffffffff)
+                way += packedField(2, packedVarints([strings.index(k) for k, v in tags]))
+                way += packedField(3, packedVarints([strings.index(v) for k, v in tags]))
+                way += packedField(8, packed_refs)
+                group.append(bytesField(3, way))
+            self.writeBlock(strings, b"".join(group))
+
+    #relations is a sequence of (id, tags, members), the members being a list of (type, ref, role)
+    def writeRelations(self, relations):
+        for block in self.blocks(relations):
+            strings = StringTable()
+            group = []
+            memids = packedDeltasOfSequences([[ref for member_type, ref, role in members] for relation_id, tags, members in block])
+            for (relation_id, tags, members), packed_memids in zip(block, memids):
+                relation = varintField(1, relation_id & 0xffffffffffffffff)
+                relation += packedField(2, packedVarints([strings.index(k) for k, v in tags]))
+                relation += packedField(3, packedVarints([strings.index(v) for k, v in tags]))
+                relation += packedField(8, packedVarints([strings.index(role) for member_type, ref, role in members]))
+                relation += packedField(9, packed_memids)
+                relation += packedField(10, packedVarints([MEMBER_TYPES[member_type] for member_type, ref, role in members]))
+                group.append(bytesField(4, relation))
+            self.writeBlock(strings, b"".join(group))
+
+    @staticmethod
+    def blocks(elements):
+        block = []
+        for element in elements:
+            block.append(element)
+            if len(block) == BLOCK_SIZE:
+                yield block
+                block = []
+        if block:
+            yield block
+
+    def close(self):
+        self.file_out.close()
@@ -0,0 +1,129 @@
+#Assembles the ways of a relation into rings, to give them the outer and inner roles and to find
+#the relations whose ways don't close. The ways are chained through a dict from every endpoint to
+#the ways ending there, so the assembly takes linear time in the number of ways.
+from shapely.geometry import Polygon
+
+
+#Returns the rings as dicts with the "ways" in the order they are chained, whether the ring is "closed",
+#and its two "ends" when it's not. endpoints has the (first, last) coordinates of every way.
+def assembleRings(way_refs,endpoints):
+    endpoint_ways = {}
+    for way_ref in way_refs:
+        for point in endpoints[way_ref]:
+            endpoint_ways.setdefault(point, []).append(way_ref)
+
+    used = set()
+
+    #Chains the ways from the end point until the ring closes or no unused way continues it
+    def extend(chain,start,end):
+        while end != start:
+            following = None
+            for way_ref in endpoint_ways[end]:
+                if way_ref not in used:
+                    following = way_ref
+                    break
+            if following is None:
+                break
+            used.add(following)
+            chain.append(following)
+            first, last = endpoints[following]
+            end = last if first == end else first
+        return end
+
+    rings = []
+    for way_ref in way_refs:
+        if way_ref in used:
+            continue
+        used.add(way_ref)
+        start, end = endpoints[way_ref]
+        forward = [way_ref]
+        end = extend(forward,start,end)
+        if end == start:
+            loops = splitLoops(forward,start,endpoints)
+            rings.append({"ways": loops.pop(), "closed": True})
+        else:
+            #An open ring, it may also continue before the way it started from
+            backward = []
+            start = extend(backward,end,start)
+            loops = splitLoops(backward[::-1] + forward,start,endpoints)
+            rings.append({"ways": loops.pop(), "closed": False, "ends": [list(start), list(end)]})
+        rings.extend({"ways": loop, "closed": True} for loop in loops)
+    return rings
+
+
+#Splits the closed loops out of a chain of ways starting at the start point, as a hole touching the outer
+#ring at one vertex can be chained into it. Returns the loops in the order they close and, last, the rest
+#of the chain, which is the whole ring when the chain is closed. Every loop starts with a way in its own
+#direction, as ringCoords expects.
+def splitLoops(chain,start,endpoints):
+    loops = []
+    ways = []
+    vertices = [start]
+    positions = {start: 0}
+    for way_ref in chain:
+        first, last = endpoints[way_ref]
+        end = vertices[-1]
+        ways.append((way_ref, first == end))
+        end = last if first == end else first
+        if end not in positions:
+            positions[end] = len(vertices)
+            vertices.append(end)
+            continue
+        position = positions[end]
+        loop = ways[position:]
+        del ways[position:]
+        for vertex in vertices[position + 1:]:
+            del positions[vertex]
+        del vertices[position + 1:]
+        loops.append(loop)
+    loops = [orientLoop(loop) for loop in loops]
+    if ways:
+        loops.append([way_ref for way_ref, forward in ways])
+    return loops
+
+
+#The ways of a loop starting with a way in its own direction, rotated to it or following the loop backwards
+def orientLoop(loop):
+    for i, (way_ref, forward) in enumerate(loop):
+        if forward:
+            return [way_ref for way_ref, forward in loop[i:] + loop[:i]]
+    return [way_ref for way_ref, forward in loop[::-1]]
+
+
+#Coordinates of a closed ring, following its ways in order. The first way is in its own direction,
+#as splitLoops orients the closed rings.
+def ringCoords(ring,lines):
+    coords = []
+    for way_ref in ring["ways"]:
+        way_coords = list(lines[way_ref].coords)
+        if coords and way_coords[0] != coords[-1]:
+            way_coords.reverse()
+        coords.extend(way_coords[1:] if coords else way_coords)
+    return coords
+
+
+#Sets the "role" of every closed ring: a ring inside an odd number of the other rings is a hole ("inner").
+#Only the bigger rings whose bounding box contains the ring are tested. The open rings are left "outer",
+#as every way was before.
+def ringRoles(rings,lines):
+    closed = [ring for ring in rings if ring["closed"]]
+    for ring in rings:
+        ring["role"] = "outer"
+    if len(closed) < 2:
+        return rings
+    polygons = []
+    for ring in closed:
+        coords = ringCoords(ring,lines)
+        polygon = Polygon(coords) if len(coords) > 3 else Polygon()
+        polygons.append((polygon.area, polygon.bounds, polygon, ring))
+    polygons.sort(key=lambda item: -item[0])
+    for i, (area, bounds, polygon, ring) in enumerate(polygons):
+        if polygon.is_empty:
+            continue
+        containers = 0
+        for other_area, other_bounds, other, other_ring in polygons[:i]:
+            if other_area > area and other_bounds[0] <= bounds[0] and other_bounds[1] <= bounds[1] and other_bounds[2] >= bounds[2] and other_bounds[3] >= bounds[3] and other.covers(polygon):
+                containers += 1
+        if containers % 2 == 1:
+            ring["role"] = "inner"
+    return rings
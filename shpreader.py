@@ -0,0 +1,111 @@
+#Reads the polygons of an ESRI Shapefile (.shp and its .dbf) as GeoJSON-like features,
+#so SHPtoOSMBoundaries can use it directly without converting it first to GeoJSON in QGIS.
+#Only the Python standard library is used.
+import os
+import struct
+
+NULL_SHAPE = 0
+POLYGON_TYPES = (5, 15, 25)  #Polygon, PolygonZ and PolygonM
+
+#Encoding of the .dbf texts when there is no .cpg file next to it
+DEFAULT_DBF_ENCODING = 'utf-8'
+
+
+def readDbfEncoding(basename):
+    cpg_filename = basename + '.cpg'
+    if os.path.exists(cpg_filename):
+        with open(cpg_filename) as f:
+            encoding = f.read().strip()
+        if encoding:
+            return encoding
+    return DEFAULT_DBF_ENCODING
+
+
+def parseDbfValue(field_type, decimals, raw, encoding):
+    value = raw.strip(b' \x00')
+    if field_type in b'CM':
+        return raw.rstrip(b' \x00').decode(encoding, 'replace')
+    if not value or value.startswith(b'*') or value == b'?':
+        return None
+    if field_type in b'NF':
+        if decimals == 0 and field_type == b'N'[0]:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        return float(value)
+    if field_type in b'L':
+        return value in (b'T', b't', b'Y', b'y')
+    if field_type in b'D':
+        value = value.decode('ascii')
+        return '%s-%s-%s' % (value[:4], value[4:6], value[6:8])
+    return value.decode(encoding, 'replace')
+
+
+#Yields the attributes of every record of the .dbf file as a dict
+def iterDbfRecords(dbf_filename, encoding):
+    with open(dbf_filename, 'rb') as f:
+        header = f.read(32)
+        num_records, header_length, record_length = struct.unpack('<IHH', header[4:12])
+        fields = []
+        while f.tell() < header_length - 1:
+            descriptor = f.read(32)
+            if descriptor[0] == 0x0D:
+                break
+            name = descriptor[:11].split(b'\x00')[0].decode(encoding, 'replace')
+            fields.append((name, descriptor[11], descriptor[16], descriptor[17]))
+        f.seek(header_length)
+        for i in range(num_records):
+            record = f.read(record_length)
+            if len(record) < record_length:
+                break
+            properties = {}
+            pos = 1  #The first byte is the deletion flag
+            for name, field_type, length, decimals in fields:
+                properties[name] = parseDbfValue(field_type, decimals, record[pos:pos + length], encoding)
+                pos += length
+            yield record[0] == 0x2A, properties
+
+
+#Yields the rings of every record of the .shp file, or None for the records without geometry
+def iterShpRings(shp_filename):
+    with open(shp_filename, 'rb') as f:
+        header = f.read(100)
+        file_length = struct.unpack('>i', header[24:28])[0] * 2
+        while f.tell() < file_length:
+            record_header = f.read(8)
+            if len(record_header) < 8:
+                break
+            content_length = struct.unpack('>ii', record_header)[1] * 2
+            content = f.read(content_length)
+            shape_type = struct.unpack('<i', content[:4])[0]
+            if shape_type == NULL_SHAPE:
+                yield None
+                continue
+            if shape_type not in POLYGON_TYPES:
+                raise ValueError('%s: only polygon shapefiles are supported, found shape type %d' % (shp_filename, shape_type))
+            num_parts, num_points = struct.unpack('<ii', content[36:44])
+            parts = struct.unpack('<%di' % num_parts, content[44:44 + 4 * num_parts])
+            points_start = 44 + 4 * num_parts
+            coords = struct.unpack('<%dd' % (2 * num_points), content[points_start:points_start + 16 * num_points])
+            ends = parts[1:] + (num_points,)
+            rings = []
+            for start, end in zip(parts, ends):
+                rings.append([[coords[2 * i], coords[2 * i + 1]] for i in range(start, end)])
+            yield rings
+
+
+#Yields one MultiPolygon feature per record, each ring as its own polygon, which is the structure
+#fillingLevelWays reads. Deleted records and records without geometry are skipped.
+def iterShapefileFeatures(filename):
+    basename = os.path.splitext(filename)[0]
+    encoding = readDbfEncoding(basename)
+    records = iterDbfRecords(basename + '.dbf', encoding)
+    for rings, (deleted, properties) in zip(iterShpRings(basename + '.shp'), records):
+        if deleted or not rings:
+            continue
+        yield {
+            'type': 'Feature',
+            'properties': properties,
+            'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring] for ring in rings]},
+        }
@@ -0,0 +1,66 @@
+#Simplifies the boundary ways with the Douglas-Peucker algorithm, keeping the topology between them.
+#The endpoints of the ways and the vertices shared by several ways (junctions) are never removed, so
+#every way still meets its neighbours at the same nodes, and a way shared by two relations is the same
+#simplified way in both. The distances of each step are computed with NumPy over the coordinates array.
+import numpy as np
+
+
+#Indexes of the points kept by Douglas-Peucker between the points first and last, both kept
+def douglasPeucker(points,first,last,tolerance,keep):
+    stack = [(first, last)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a = points[start]
+        b = points[end]
+        inner = points[start + 1:end]
+        dx, dy = b - a
+        length = np.hypot(dx, dy)
+        if length == 0:
+            #The section closes on itself, the distances are to its start
+            distances = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            distances = np.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+
+#Returns the coordinates of the way without the points closer than tolerance to the simplified line,
+#keeping the points whose index is in fixed
+def simplifyCoords(coords,tolerance,fixed=()):
+    points = np.asarray(coords, dtype=float)
+    if len(points) < 3:
+        return coords
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    for index in fixed:
+        keep[index] = True
+    anchors = np.flatnonzero(keep)
+    for first, last in zip(anchors, anchors[1:]):
+        douglasPeucker(points,first,last,tolerance,keep)
+    simplified = [tuple(p) for p in points[keep]]
+    #A closed way needs 4 points to stay a ring
+    if simplified[0] == simplified[-1] and len(simplified) < 4:
+        return coords
+    return simplified
+
+
+#Simplifies all the ways, a dict of coordinate lists by way_ref. Returns the simplified ones by way_ref.
+def simplifyWays(ways,tolerance):
+    #The vertices used by more than one way, or twice by the same way
+    occurrences = {}
+    for coords in ways.values():
+        for point in coords[1:-1]:
+            occurrences[point] = occurrences.get(point, 0) + 1
+        for point in {coords[0], coords[-1]}:
+            occurrences[point] = occurrences.get(point, 0) + 2
+    simplified = {}
+    for way_ref, coords in ways.items():
+        fixed = [i for i in range(1, len(coords) - 1) if occurrences[coords[i]] > 1]
+        simplified[way_ref] = simplifyCoords(coords,tolerance,fixed)
+    return simplified
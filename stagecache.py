@@ -0,0 +1,79 @@
+#A content-addressed cache for the outputs of the conversion stages.
+#Every entry is a pickle file named by the hash of the stage inputs and settings, so a stage whose
+#inputs did not change is loaded instead of computed again. The least recently used entries are
+#removed when the cache grows over max_size bytes.
+import hashlib
+import os
+import pickle
+import tempfile
+
+#Changing it invalidates all the entries written by older versions of the stages
+CACHE_VERSION = 3
+
+
+def hashParts(*parts):
+    h = hashlib.sha256(str(CACHE_VERSION).encode())
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = repr(part).encode('utf-8')
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+
+def hashFile(filename, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StageCache(object):
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    #Returns the value stored for the key, or None when it's not in the cache or can't be loaded,
+    #like an entry pickling a class that can't be imported here
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except Exception:
+            return None
+        #Touching it, so the entries used recently are the last ones evicted
+        os.utime(path, None)
+        return value
+
+    def put(self, key, value):
+        #Written to a temporary file first, so an interrupted run never leaves a broken entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path(key))
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pickle'):
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            os.remove(path)
+            total_size -= size
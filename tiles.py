@@ -0,0 +1,72 @@
+#Partitions the splitted ways and the polygons into a grid of square tiles, so every tile can be cleaned
+#and searched on its own with only its ways and polygons in memory. The ways are not cut at the tile
+#edges: every way is checked in the tile of its first point (its home tile), and it's also written to the
+#other tiles its segments pass through. A way or a polygon containing a way passes through the first
+#point of that way, so the home tile of every way has all the ways and polygons that can contain it.
+import os
+import pickle
+
+import numpy as np
+
+
+def homeTile(coords,tile_size):
+    tx, ty = np.floor(coords[0] / tile_size).astype(np.int64).tolist()
+    return (tx, ty)
+
+
+#The tiles the bounding boxes of the segments of a line intersect, for an array of coordinates
+def lineTiles(coords,tile_size):
+    cells = np.floor(coords / tile_size).astype(np.int64)
+    #Most ways are inside a single tile
+    first = cells[0]
+    if (cells == first).all():
+        return {tuple(first.tolist())}
+    lows = np.minimum(cells[1:], cells[:-1])
+    highs = np.maximum(cells[1:], cells[:-1])
+    single = (lows == highs).all(axis=1)
+    tiles = set(map(tuple, lows[single].tolist()))
+    for (minx, miny), (maxx, maxy) in zip(lows[~single].tolist(), highs[~single].tolist()):
+        for tx in range(minx, maxx + 1):
+            for ty in range(miny, maxy + 1):
+                tiles.add((tx, ty))
+    return tiles
+
+
+#The items of every key, a tuple like ("ways", tx, ty), are appended to a file of the directory, one
+#pickled batch at a time, buffering up to batch_size items in memory
+class TileFiles(object):
+    def __init__(self, directory, batch_size=10000):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.buffered = 0
+
+    def filename(self, key):
+        return os.path.join(self.directory, "_".join(str(part) for part in key))
+
+    def add(self, key, item):
+        self.buffers.setdefault(key, []).append(item)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for key, items in self.buffers.items():
+            with open(self.filename(key), "ab") as f:
+                pickle.dump(items, f, pickle.HIGHEST_PROTOCOL)
+        self.buffers = {}
+        self.buffered = 0
+
+    #Yields the items of the key in the order they were added, once they are flushed
+    def read(self, key):
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            return
+        with open(filename, "rb") as f:
+            while True:
+                try:
+                    items = pickle.load(f)
+                except EOFError:
+                    return
+                for item in items:
+                    yield item
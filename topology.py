@@ -0,0 +1,199 @@
+#Builds a planar arc-node topology from the polygons loaded by fillingLevelWays.
+#Every edge shared by two polygons is stored only once, as an arc with the polygon on its left and
+#the polygon on its right, so the relations of each arc are known without searching the polygons.
+#The rings are first split at the vertices of the other rings lying on their segments, so two polygons
+#share the same vertices along their common border even when only one of them had a vertex there.
+import numpy as np
+import shapely
+from shapely.geometry import LineString,Point,Polygon
+from shapely.strtree import STRtree
+
+
+def ringArea(coords):
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(coords, coords[1:]):
+        area += x1 * y2 - x2 * y1
+    return area / 2.0
+
+
+#A ring is a hole when it is inside an odd number of the other rings of the same polygon,
+#as an island in the hole of a polygon is inside both its outer ring and the hole
+def holeRings(rings):
+    if len(rings) < 2:
+        return [False] * len(rings)
+    shells = [Polygon(ring) if len(ring) > 3 else None for ring in rings]
+    holes = []
+    for i, ring in enumerate(rings):
+        point = Point(ring[0])
+        containers = sum(1 for j, shell in enumerate(shells) if shell is not None and j != i and shell.contains(point))
+        holes.append(containers % 2 == 1)
+    return holes
+
+
+#The vertices of the other rings closer to the segments of the ring lines than the tolerance, as a dict
+#with the segments to split, numbered along all the lines, and the points to add to each of them.
+#Only the segments without the same two ends in another ring are split.
+def splitPoints(lines,tolerance=0.0):
+    coords = shapely.get_coordinates(lines)
+    lengths = shapely.get_num_coordinates(lines)
+    is_start = np.ones(len(coords), dtype=bool)
+    is_start[np.cumsum(lengths)[lengths > 0] - 1] = False
+    start_indexes = np.nonzero(is_start)[0]
+    starts = coords[start_indexes]
+    ends = coords[start_indexes + 1]
+    del coords
+    line_indexes = np.repeat(np.arange(len(lines)), np.maximum(lengths - 1, 0))
+
+    #The segments used by a single ring, found by sorting them with their two ends in increasing order
+    keys = np.hstack([starts, ends])
+    swap = (starts[:, 0] > ends[:, 0]) | ((starts[:, 0] == ends[:, 0]) & (starts[:, 1] > ends[:, 1]))
+    keys[swap] = keys[swap][:, [2, 3, 0, 1]]
+    order = np.lexsort(keys.T[::-1])
+    repeated = np.ones(max(len(order) - 1, 0), dtype=bool)
+    for column in keys.T:
+        column = column[order]
+        repeated &= column[1:] == column[:-1]
+    del keys
+    shared = np.zeros(len(order), dtype=bool)
+    shared[order[1:][repeated]] = True
+    shared[order[:-1][repeated]] = True
+    single = np.nonzero(~shared & (starts != ends).any(axis=1))[0]
+    if not len(single):
+        return {}
+
+    starts = starts[single]
+    ends = ends[single]
+    vertices = np.unique(np.vstack([starts, ends]), axis=0)
+    segments = shapely.linestrings(np.stack([starts, ends], axis=1))
+    found_segments, found_vertices = STRtree(shapely.points(vertices)).query(segments, predicate="dwithin", distance=tolerance)
+    #The ends of the segments are always found
+    found_points = vertices[found_vertices]
+    inner = ~((found_points == starts[found_segments]).all(axis=1) | (found_points == ends[found_segments]).all(axis=1))
+    inserted = {}
+    line_vertices = {}
+    for segment, point in zip(single[found_segments[inner]].tolist(), found_points[inner].tolist()):
+        line = line_indexes[segment]
+        if line not in line_vertices:
+            line_vertices[line] = set(map(tuple, lines[line].coords))
+        point = tuple(point)
+        if point not in line_vertices[line]:
+            inserted.setdefault(segment, []).append(point)
+    return inserted
+
+
+#The ring with the split points added to its segments, ordered along each segment
+def splitRing(ring,first_segment,inserted):
+    coords = ring[:1]
+    for segment, (a, b) in enumerate(zip(ring, ring[1:]), first_segment):
+        if segment in inserted:
+            dx, dy = b[0] - a[0], b[1] - a[1]
+            coords.extend(sorted(inserted[segment], key=lambda p: (p[0] - a[0]) * dx + (p[1] - a[1]) * dy))
+        coords.append(b)
+    return coords
+
+
+#Reports the borders written twice: arcs with a polygon at only one side overlapping an arc of another
+#polygon, like neighbours whose common border is further apart than the tolerance
+def reportOverlappingArcs(arcs):
+    one_sided = [arc for arc in arcs if arc["left"] is None or arc["right"] is None]
+    if not one_sided:
+        return 0
+    lines = [LineString(arc["coords"]) for arc in one_sided]
+    overlaps = 0
+    for i, j in zip(*STRtree(lines).query(lines, predicate="intersects").tolist()):
+        if i >= j or arcSides(one_sided[i]) == arcSides(one_sided[j]):
+            continue
+        if lines[i].intersection(lines[j]).length > 0:
+            start = one_sided[i]["coords"][0]
+            print("Polygons",arcSides(one_sided[i])[0],"and",arcSides(one_sided[j])[0],"overlap along the arc starting at",start[1]," ",start[0],", their border is written twice")
+            overlaps += 1
+    return overlaps
+
+
+#Returns the arcs as dicts with the "coords" of the arc and the codes of the polygons
+#at its "left" and "right" (None for the outer side of the whole dataset).
+#The vertices closer than the tolerance to a segment of another polygon are added to it.
+def buildTopology(level_ways,tolerance=0.0):
+    inserted = splitPoints([line for way_with_tags in level_ways.values() for line in way_with_tags["geometry"].geoms],tolerance)
+    #Every segment keyed by its two ends in increasing order, with the polygons that use it and
+    #whether they are at the left of the segment in that order
+    segment_sides = {}
+    neighbours = {}
+    first_segment = 0
+    for code, way_with_tags in level_ways.items():
+        rings = [[tuple(p[:2]) for p in line.coords] for line in way_with_tags["geometry"].geoms]
+        for ring, is_hole in zip(rings, holeRings(rings)):
+            segments = max(len(ring) - 1, 0)
+            if inserted:
+                ring = splitRing(ring,first_segment,inserted)
+            first_segment += segments
+            inside_left = (ringArea(ring) > 0) != is_hole
+            for a, b in zip(ring, ring[1:]):
+                if a == b:
+                    continue
+                if a < b:
+                    key, left = (a, b), inside_left
+                else:
+                    key, left = (b, a), not inside_left
+                if key not in segment_sides:
+                    segment_sides[key] = []
+                    neighbours.setdefault(a, []).append(b)
+                    neighbours.setdefault(b, []).append(a)
+                segment_sides[key].append((code, left))
+
+    def sides(a, b):
+        if a < b:
+            return segment_sides[(a, b)]
+        return [(code, not left) for code, left in segment_sides[(b, a)]]
+
+    def signature(a, b):
+        return frozenset(code for code, left in segment_sides[(a, b) if a < b else (b, a)])
+
+    #The arcs end where three or more segments meet, or where the polygons of the segments change
+    def isNode(vertex):
+        near = neighbours[vertex]
+        return len(near) != 2 or signature(vertex, near[0]) != signature(vertex, near[1])
+
+    visited = set()
+
+    def walk(start, second):
+        coords = [start, second]
+        visited.add((start, second) if start < second else (second, start))
+        previous, current = start, second
+        while current != start and not isNode(current):
+            near = neighbours[current]
+            following = near[1] if near[0] == previous else near[0]
+            key = (current, following) if current < following else (following, current)
+            if key in visited:
+                break
+            visited.add(key)
+            coords.append(following)
+            previous, current = current, following
+        arc = {"coords": coords, "left": None, "right": None}
+        for code, left in sides(start, second):
+            side = "left" if left else "right"
+            #Overlapping polygons, the first one is kept
+            if arc[side] is not None and arc[side] != code:
+                print("Polygons",arc[side],"and",code,"overlap at the",side,"of the arc starting at",start[1]," ",start[0],", keeping",arc[side])
+                continue
+            arc[side] = code
+        return arc
+
+    arcs = []
+    for vertex in neighbours:
+        if isNode(vertex):
+            for following in neighbours[vertex]:
+                key = (vertex, following) if vertex < following else (following, vertex)
+                if key not in visited:
+                    arcs.append(walk(vertex, following))
+    #What is left are closed rings without any node, like islands or enclaves
+    for (a, b) in segment_sides:
+        if (a, b) not in visited:
+            arcs.append(walk(a, b))
+    reportOverlappingArcs(arcs)
+    return arcs
+
+
+#Codes of the polygons at both sides of the arc, the polygon at the left first
+def arcSides(arc):
+    return [code for code in (arc["left"], arc["right"]) if code is not None]
@@ -5,32 +5,66 @@ Python OSM XML converter.
 
 Usage is extremely simple:
 
->>> from osm2py import load_osm
->>> load_osm(open('my_file.osm'))
+>>> from osm2python import load_osm
+>>> load_osm(open('my_file.osm', 'rb'))
 [<a list of all the XML elements as dictionaries (see help(load_osm) for more info)>]
 
 If you want to save the elements into a custom storage, define a callback:
 
 >>> def cb(current, parent):
-        print current
+        print(current)
 
->>> load_osm(open('my_file.osm'), cb)
+>>> load_osm(open('my_file.osm', 'rb'), cb)
 (will just print all the dictionaries)
 
 You can also create an arbitrary filter for the elements:
 >>> flt = lambda elt: elt['name'] == 'node' and (54 < int(elt['attrs']['lat']) < 56) and (82 < int(elt['attrs']['lon']) < 84)
->>> load_osm(open('my_file.osm'), element_filter=flt)
+>>> load_osm(open('my_file.osm', 'rb'), element_filter=flt)
 <list of dictionaries>
 
 osm_json.py dumps these dictionaries in json format.
 
 tree.py can import from OSM XML in Python objects representing the document and linking correctly one another.
+
+Compressed files (.bz2, .gz, .xz) are opened with open_osm:
+
+>>> load_osm(open_osm('my_file.osm.bz2'))
 """
+import bz2
+import gzip
+import lzma
+import re
+import sys
 import xml.parsers.expat
 import xml.sax.saxutils
 
 allowed = 'bounds bound tag node way nd member relation'.split()
 
+# characters written to the stream at once by dump_osm
+BUFFER_SIZE = 1024 * 1024
+
+# bytes read from the stream and passed to expat at once by load_osm
+READ_BUFFER_SIZE = 64 * 1024
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+OPENERS = {
+	'.bz2': bz2.open,
+	'.gz': gzip.open,
+	'.xz': lzma.open,
+	'.lzma': lzma.open,
+}
+
+
+def open_osm(filename, mode='rb'):
+	"""
+	Opens an OSM file in binary mode, decompressing it when it ends with .bz2, .gz, .xz or .lzma.
+	"""
+	for extension, opener in OPENERS.items():
+		if filename.endswith(extension):
+			return opener(filename, mode)
+	return open(filename, mode)
+
 
 def default_element_filter(element):
 	"""
@@ -39,7 +73,55 @@ def default_element_filter(element):
 	return element['name'] in allowed
 
 
-def load_osm(stream, load_callback=None, element_filter=None):
+class OsmParser(object):
+	"""
+	The state of a load_osm call: the expat parser, the current element and the stack of its remembered ancestors.
+	"""
+	def __init__(self, load_callback, element_filter, buffer_size=READ_BUFFER_SIZE):
+		self.load_callback = load_callback
+		self.element_filter = element_filter
+		self.buffer_size = buffer_size
+		self.elements = []
+		# the elements not remembered are left out of the stack, so their children go to the closest remembered ancestor
+		self.current = {'name': None, 'attrs': {}, 'children': self.elements}
+		self.stack = []
+		self.remembered = []
+
+		self.parser = xml.parsers.expat.ParserCreate()
+		self.parser.buffer_text = True
+		self.parser.buffer_size = buffer_size
+		self.parser.StartElementHandler = self.start_element
+		self.parser.EndElementHandler = self.end_element
+
+	def start_element(self, name, attrs):
+		new_current = {'name': name, 'attrs': attrs, 'children': []}
+		remember = self.element_filter(new_current)
+		self.remembered.append(remember)
+		if remember:
+			self.stack.append(self.current)
+			self.current = new_current
+
+	def end_element(self, name):
+		if self.remembered.pop():
+			parent = self.stack.pop()
+			self.load_callback(self.current, parent)
+			self.current = parent
+
+	def parse(self, stream):
+		"""
+		Feeds expat with chunks of `buffer_size` bytes (or characters) of `stream`.
+		"""
+		read = stream.read
+		parse = self.parser.Parse
+		chunk = read(self.buffer_size)
+		while chunk:
+			parse(chunk, False)
+			chunk = read(self.buffer_size)
+		parse(b'', True)
+		return self.elements
+
+
+def load_osm(stream, load_callback=None, element_filter=None, buffer_size=READ_BUFFER_SIZE):
 	"""
 	Loads data from OSM file `stream` into wherever, filtering the XML elements with `element_filter` and calling `load_callback` with them. By default, the data is saved as a dictionaries hierarchy and returned.
 
@@ -51,48 +133,84 @@ def load_osm(stream, load_callback=None, element_filter=None):
 		'children': [ a list of similar dictionaries ]
 	}
 
+	If `element_filter` returns False, the element is skipped and its remembered children are passed to `load_callback` with the closest remembered ancestor as parent. The filter is called once per element, at its start.
+
 	If `element_filter` returns True, at the end of the element `load_callback` will be called, with the element (the same dictionary instance), plus the parent element dictionary. The parent will NOT contain the current element. Instead, it's `load_callback`'s duty to save it somewhere (in parent['children'] for instance).
 
+	The stream is read in chunks of `buffer_size`, open it in binary mode (see open_osm).
+
 	In the end, load_osm will return the `elements` list.
 	"""
-
-	# saving into closure
-	load_osm.current = None
-	load_osm.stack = []
-	load_osm.elements = []
-
 	if not load_callback:
 		def load_callback(current, parent):
 			parent['children'].append(current)
 
 	element_filter = element_filter or default_element_filter
 
-	def start_element(name, attrs):
-		new_current = {'name': name, 'attrs': attrs, 'children': []}
-		if element_filter(new_current) and load_osm.current:
-			load_osm.stack.append(load_osm.current)
-		load_osm.current = new_current
+	return OsmParser(load_callback, element_filter, buffer_size).parse(stream)
+
 
-	def end_element(name):
-		if load_osm.current and element_filter(load_osm.current):
-			parent = load_osm.stack.pop() if load_osm.stack else load_osm.elements
-			load_callback(load_osm.current, parent)
-			load_osm.current = parent
+# attribute values that need escaping or a different quote, left to xml.sax.saxutils.quoteattr
+_special_attr_chars = re.compile('[&<>"\n\r\t]')
 
-	p = xml.parsers.expat.ParserCreate()
-	p.StartElementHandler = start_element
-	p.EndElementHandler = end_element
-	p.ParseFile(stream)
 
-	return load_osm.elements
+def _quote_attr(value):
+	if _special_attr_chars.search(value):
+		return xml.sax.saxutils.quoteattr(value)
+	return '"%s"' % value
+
+
+def _start_tag(elt):
+	"""
+	The start tag of `elt` as XMLGenerator.startElement writes it. The attributes dict is built the same way to write them in the same order.
+	"""
+	attrs = {k: str(v) for k, v in elt.get('attrs', {}).items()}
+	return '<%s%s>' % (elt['name'], ''.join([' %s=%s' % (k, _quote_attr(v)) for k, v in attrs.items()]))
+
+
+def _write_elements(stream, elements, level=0, buffer_size=BUFFER_SIZE):
+	"""
+	Writes the `elements` sequence and their children, in the same format as the SAX dumper, without recursion.
+
+	The text is encoded and written to `stream` in chunks of about `buffer_size` characters.
+	"""
+	pieces = []
+	pieces_size = 0
+	# the children iterators being written, with the end tag of their parent
+	stack = [(iter(elements), None)]
+	while stack:
+		if pieces_size >= buffer_size:
+			stream.write(''.join(pieces).encode('utf-8'))
+			pieces = []
+			pieces_size = 0
+		children, end_tag = stack[-1]
+		indent = '  ' * (level + len(stack) - 1)
+		for elt in children:
+			piece = indent + _start_tag(elt)
+			if 'children' in elt:
+				piece += '\n'
+				stack.append((iter(elt['children']), '%s</%s>\n' % (indent, elt['name'])))
+				pieces.append(piece)
+				pieces_size += len(piece)
+				break
+			piece += '%s</%s>\n' % (indent, elt['name'])
+			pieces.append(piece)
+			pieces_size += len(piece)
+		else:
+			stack.pop()
+			if end_tag is not None:
+				pieces.append(end_tag)
+	stream.write(''.join(pieces).encode('utf-8'))
 
 
 def _dump_element(doc, elt, level=0):
 	"""
 	A recursive function that dumps an element into XML document tree.
+
+	This is the former SAX dumper, _write_elements writes the same output faster. It's kept to benchmark them (see tree.py).
 	"""
 	doc.characters('  ' * level)
-	doc.startElement(elt['name'], attrs={k: unicode(v) for k, v in elt.get('attrs', {}).items()})
+	doc.startElement(elt['name'], attrs={k: str(v) for k, v in elt.get('attrs', {}).items()})
 
 	if 'children' in elt:
 		doc.characters('\n')
@@ -104,7 +222,19 @@ def _dump_element(doc, elt, level=0):
 	doc.characters('\n')
 
 
-def dump_osm(stream, elements, osm_attrs=None):
+def dump_osm_sax(stream, elements, osm_attrs=None):
+	"""
+	Generates the same document as dump_osm through xml.sax.saxutils.XMLGenerator, slower.
+	"""
+	osm_attrs = osm_attrs or {'version': '0.6'}
+
+	doc = xml.sax.saxutils.XMLGenerator(stream, 'UTF-8')
+	doc.startDocument()
+	_dump_element(doc, {'name': 'osm', 'attrs': osm_attrs, 'children': elements})
+	doc.endDocument()
+
+
+def dump_osm(stream, elements, osm_attrs=None, buffer_size=BUFFER_SIZE):
 	"""
 	Generates an OSM XML document from `elements` sequence.
 	The `elements` sequence must return dictionaries like the following:
@@ -116,29 +246,74 @@ def dump_osm(stream, elements, osm_attrs=None):
 	}
 
 	'tags' and 'children' keys are optional. Hint: `children` sequence can be a recursive generator that extracts dictionaries from somewhere.
+
+	The document is written to `stream` encoded in UTF-8, in chunks of about `buffer_size` characters.
 	"""
 	if not hasattr(elements, '__iter__'):
 		raise ValueError('Elements must be an iterable')
 
 	osm_attrs = osm_attrs or {'version': '0.6'}
 
-	doc = xml.sax.saxutils.XMLGenerator(stream, 'UTF-8')
-	doc.startDocument()
-	_dump_element(doc, {'name': 'osm', 'attrs': osm_attrs, 'children': elements})
-	doc.endDocument()
+	stream.write(XML_DECLARATION)
+	_write_elements(stream, [{'name': 'osm', 'attrs': osm_attrs, 'children': elements}], buffer_size=buffer_size)
 
 
-if __name__ == '__main__':
-	import bz2
-	import sys
-	infilename = sys.argv[1]
-	open_func = bz2.BZ2File if infilename.endswith('.bz2') else open
-	with open_func(infilename) as infile:
-		if len(sys.argv) > 2:
-			from cProfile import Profile
-			p = Profile()
-			stat = p.runctx('dump(tgt, load(src))', {'load': load_osm, 'dump': dump_osm, 'src': infile, 'tgt': sys.stdout}, {})
-			stat.print_stats()
+def copy_osm(stream, outstream, element_callback=None, osm_attrs=None, buffer_size=BUFFER_SIZE):
+	"""
+	Copies the OSM document from `stream` into `outstream`, in the format of dump_osm, holding in memory only the current element.
+
+	`element_callback` is called with every node, way or relation dictionary (see load_osm) before it's written, so it can change the element, e.g. add a tag to its children.
+	"""
+	osm_attrs = osm_attrs or {'version': '0.6'}
 
+	# the top-level elements are collected and written in chunks
+	elements = []
+
+	def load_callback(current, parent):
+		if parent['name'] is None:
+			if element_callback:
+				element_callback(current)
+			elements.append(current)
+			if len(elements) >= 1000:
+				_write_elements(outstream, elements, 1, buffer_size)
+				del elements[:]
 		else:
-			dump_osm(sys.stdout, load_osm(infile))
+			if not current['children']:
+				del current['children']
+			parent['children'].append(current)
+
+	outstream.write(XML_DECLARATION)
+	outstream.write(_start_tag({'name': 'osm', 'attrs': osm_attrs}).encode('utf-8') + b'\n')
+	load_osm(stream, load_callback=load_callback)
+	_write_elements(outstream, elements, 1, buffer_size)
+	outstream.write(b'</osm>\n')
+
+def benchmark(infilename, buffer_sizes=(16 * 1024, 64 * 1024, 1024 * 1024)):
+	"""
+	Prints the throughput of load_osm reading `infilename` with different buffer sizes, with a callback that keeps nothing.
+	"""
+	import os
+	import time
+	size = os.path.getsize(infilename)
+	for buffer_size in buffer_sizes:
+		with open_osm(infilename) as infile:
+			start = time.time()
+			load_osm(infile, load_callback=lambda current, parent: None, buffer_size=buffer_size)
+			elapsed = time.time() - start
+		sys.stderr.write('buffer %8d: %.3f s, %.1f MB/s\n' % (buffer_size, elapsed, size / elapsed / 1024 / 1024))
+
+
+if __name__ == '__main__':
+	infilename = sys.argv[1]
+	if len(sys.argv) > 2 and sys.argv[2] == 'benchmark':
+		benchmark(infilename)
+	else:
+		with open_osm(infilename) as infile:
+			if len(sys.argv) > 2:
+				from cProfile import Profile
+				p = Profile()
+				stat = p.runctx('dump(tgt, load(src))', {'load': load_osm, 'dump': dump_osm, 'src': infile, 'tgt': sys.stdout.buffer}, {})
+				stat.print_stats()
+
+			else:
+				dump_osm(sys.stdout.buffer, load_osm(infile))
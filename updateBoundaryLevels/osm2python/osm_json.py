@@ -3,7 +3,7 @@
 A sample script that exports OSM XML document to a simple json structure.
 
 Usage:
-$ python osm_json.py my_file.osm[.bz2] > output.json
+$ python -m osm2python.osm_json my_file.osm[.bz2|.gz|.xz] > output.json
 
 {
 	name: 'node',
@@ -27,9 +27,8 @@ $ python osm_json.py my_file.osm[.bz2] > output.json
 
 import json
 import sys
-import bz2
 
-from __init__ import load_osm
+from . import load_osm, open_osm
 
 
 def parse_json(infile, outfile):
@@ -48,6 +47,5 @@ def parse_json(infile, outfile):
 if __name__ == '__main__':
 	infilename = sys.argv[1]
 
-	open_func = bz2.BZ2File if infilename.endswith('.bz2') else open
-	with open_func(infilename, 'r') as infile:
+	with open_osm(infilename) as infile:
 		parse_json(infile, sys.stdout)
@@ -5,33 +5,142 @@ Import load() and dump() to import or export the classes structure.
 
 This example imports OSM document, re-exports it to XML and prints the contents to the system shell:
 
->>> from tree import load, dump
->>> dump(sys.stdout, load(sys.stdin))
+>>> from osm2python.tree import load, dump
+>>> dump(sys.stdout.buffer, load(sys.stdin.buffer))
 
-Call this script from the shell, for testing or benchmarking purposes:
+Call this module from the shell (in the directory of osm2python), for testing or benchmarking purposes:
 
-$ python tree.py my_document.osm[.bz2] > test.osm
+$ python -m osm2python.tree my_document.osm[.bz2|.gz|.xz] > test.osm
 
 or
 
-$ python tree.py one.osm.bz2 | bzip2 -z > two.osm.bz2
+$ python -m osm2python.tree one.osm.bz2 | bzip2 -z > two.osm.bz2
+
+or, to compare the times of dump_osm and the former SAX dumper:
+
+$ python -m osm2python.tree my_document.osm benchmark
 """
 
-import bz2
+from array import array
+from collections.abc import MutableMapping, MutableSequence
 from itertools import chain
 import sys
 
-from __init__ import load_osm, dump_osm
+from . import load_osm, dump_osm, dump_osm_sax, open_osm
+
+# Typecode of the arrays of node ids of the ways, 8 bytes integers
+NODE_ID_TYPECODE = 'q'
+
+
+class AttrsView(MutableMapping):
+	"""
+	The attributes of an element as a mutable dict. Every change is written back to the shared tuple of the element: elt.attrs['action'] = 'modify'
+	"""
+	__slots__ = ('element',)
+
+	def __init__(self, element):
+		self.element = element
+
+	def __getitem__(self, key):
+		for k, v in self.element._attrs:
+			if k == key:
+				return v
+		raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		attrs = dict(self.element._attrs)
+		attrs[key] = value
+		self.element.attrs = attrs
+
+	def __delitem__(self, key):
+		attrs = dict(self.element._attrs)
+		del attrs[key]
+		self.element.attrs = attrs
+
+	def __iter__(self):
+		return (k for k, v in self.element._attrs)
+
+	def __len__(self):
+		return len(self.element._attrs)
+
+	def __repr__(self):
+		return repr(dict(self.element._attrs))
+
+
+class NodesView(MutableSequence):
+	"""
+	The nodes of a way as a mutable list. The nodes are looked up by the ids of the way, and every change is written back to them: way.nodes.append(node)
+	"""
+	__slots__ = ('way',)
+
+	def __init__(self, way):
+		self.way = way
+
+	def __getitem__(self, index):
+		nodes = self.way.doc.nodes
+		if isinstance(index, slice):
+			return [nodes[i] for i in self.way.node_ids[index]]
+		return nodes[self.way.node_ids[index]]
+
+	def __setitem__(self, index, value):
+		if isinstance(index, slice):
+			self.way.node_ids[index] = array(NODE_ID_TYPECODE, (node.id for node in value))
+		else:
+			self.way.node_ids[index] = value.id
+
+	def __delitem__(self, index):
+		del self.way.node_ids[index]
+
+	def __len__(self):
+		return len(self.way.node_ids)
+
+	def insert(self, index, node):
+		self.way.node_ids.insert(index, node.id)
+
+	def __eq__(self, other):
+		return isinstance(other, (list, tuple, NodesView)) and list(self) == list(other)
+
+	def __repr__(self):
+		return repr(list(self))
 
 
 class GeneralMixin(object):
 	"""
 	An auxilliary class. Contains the most common methods for all the OSM elements.
+
+	The elements have __slots__ and no per-instance __dict__. The attributes are kept as a tuple of (key, value) pairs shared by all the elements with the same attributes (like action='modify'), and the tags dict is only created for the elements that have tags.
 	"""
+	__slots__ = ('doc', '_attrs', '_tags')
+
 	def __init__(self, doc, data):
 		self.doc = doc
 		self.attrs = data['attrs']
-		self.tags = {item['attrs']['k']: item['attrs']['v'] for item in self.filter_children(data, 'tag')}
+		tags = dict(
+			(doc.intern(item['attrs']['k']), doc.intern(item['attrs']['v']))
+			for item in self.filter_children(data, 'tag')
+		)
+		self._tags = tags or None
+
+	@property
+	def attrs(self):
+		"""
+		The attributes as a mutable view (see AttrsView), they can also be replaced: elt.attrs = dict(elt.attrs, action='modify')
+		"""
+		return AttrsView(self)
+
+	@attrs.setter
+	def attrs(self, attrs):
+		self._attrs = self.doc.intern_attrs(attrs)
+
+	@property
+	def tags(self):
+		if self._tags is None:
+			self._tags = {}
+		return self._tags
+
+	@tags.setter
+	def tags(self, tags):
+		self._tags = tags
 
 	@staticmethod
 	def filter_children(element, tag_name):
@@ -45,7 +154,7 @@ class GeneralMixin(object):
 		"""
 		Converts tags dictionary into dictionaries that represent XML elements.
 		"""
-		return ({'name': 'tag', 'attrs': {'k': k, 'v': v}} for k, v in self.tags.items())
+		return ({'name': 'tag', 'attrs': {'k': k, 'v': v}} for k, v in (self._tags or {}).items())
 
 	@property
 	def attrs_dict(self):
@@ -54,7 +163,7 @@ class GeneralMixin(object):
 
 		Node and Member redefine this property.
 		"""
-		return self.attrs
+		return dict(self._attrs)
 
 	@property
 	def as_dict(self):
@@ -75,9 +184,11 @@ class ElementMixin(GeneralMixin):
 	"""
 	Element mixin introduces ids: ids are popped from attributes when initialized and added when dumped to a dict. Also ids are used for string representation.
 	"""
+	__slots__ = ('id',)
+
 	def __init__(self, doc, data):
+		self.id = int(data['attrs'].pop('id'))
 		super(ElementMixin, self).__init__(doc, data)
-		self.id = int(self.attrs.pop('id'))
 
 	def __repr__(self):
 		return '%s %s' % (self.__class__.__name__, self.id)
@@ -91,13 +202,33 @@ class ElementMixin(GeneralMixin):
 
 class Node(ElementMixin):
 	"""
-	OSM Node class
+	OSM Node class. The coordinates are stored in the doc.lats and doc.lons arrays, at the index of the node.
 	"""
+	__slots__ = ('index',)
 	name = 'node'
 
 	def __init__(self, doc, data):
+		lat, lon = map(float, map(data['attrs'].pop, ('lat', 'lon')))  # 1337 :D
 		super(Node, self).__init__(doc, data)
-		self.lat, self.lon = map(float, map(data['attrs'].pop, ('lat', 'lon')))  # 1337 :D
+		self.index = len(doc.lats)
+		doc.lats.append(lat)
+		doc.lons.append(lon)
+
+	@property
+	def lat(self):
+		return self.doc.lats[self.index]
+
+	@lat.setter
+	def lat(self, lat):
+		self.doc.lats[self.index] = lat
+
+	@property
+	def lon(self):
+		return self.doc.lons[self.index]
+
+	@lon.setter
+	def lon(self, lon):
+		self.doc.lons[self.index] = lon
 
 	@property
 	def attrs_dict(self):
@@ -108,20 +239,29 @@ class Node(ElementMixin):
 
 class Way(ElementMixin):
 	"""
-	OSM Way class
+	OSM Way class. Only the ids of the nodes are stored, in an array, self.nodes looks them up in the document.
 	"""
+	__slots__ = ('node_ids',)
 	name = 'way'
 
 	def __init__(self, doc, data):
 		super(Way, self).__init__(doc, data)
-		self.nodes = [self.doc.nodes[self.ref(nd)] for nd in self.filter_children(data, 'nd')]
+		self.node_ids = array(NODE_ID_TYPECODE, (self.ref(nd) for nd in self.filter_children(data, 'nd')))
+
+	@property
+	def nodes(self):
+		return NodesView(self)
+
+	@nodes.setter
+	def nodes(self, nodes):
+		self.node_ids = array(NODE_ID_TYPECODE, (node.id for node in nodes))
 
 	@property
 	def as_dict(self):
 		data = super(Way, self).as_dict
 		data['children'] = chain(
 			data['children'],
-			({'name': 'nd', 'attrs': {'ref': node.id}} for node in self.nodes),
+			({'name': 'nd', 'attrs': {'ref': i}} for i in self.node_ids),
 		)
 		return data
 
@@ -130,14 +270,17 @@ class Member(GeneralMixin):
 	"""
 	OSM Relation membership class. Is standalone, since membership also has role to it, which belongs neither to the relation, nor to the member element.
 	"""
+	__slots__ = ('relation', 'role', 'member_type', 'ref')
 	name = 'member'
 
 	def __init__(self, relation, data):
 		self.relation = relation
+		self.doc = relation.doc
+		self.role = self.doc.intern(data['attrs'].pop('role'))
+		self.member_type = self.doc.intern(data['attrs'].pop('type'))
+		self.ref = GeneralMixin.ref(data)
 		self.attrs = data['attrs']
-		self.role = self.attrs.pop('role')
-		self.member_type = self.attrs.pop('type')
-		self.ref = self.ref(data)
+		self._tags = None
 
 	@property
 	def tags(self):
@@ -146,7 +289,7 @@ class Member(GeneralMixin):
 
 	@property
 	def member(self):
-		return self.relation.doc.dicts[self.member_type][self.ref]
+		return self.doc.dicts[self.member_type][self.ref]
 
 	@member.setter
 	def member(self, new_member):
@@ -165,6 +308,7 @@ class Relation(ElementMixin):
 	"""
 	OSM Relation class. Contains Member instances in self.members, which lead to the real relation members (nodes, ways or other relations).
 	"""
+	__slots__ = ('members',)
 	name = 'relation'
 
 	def __init__(self, doc, data):
@@ -183,7 +327,7 @@ class Relation(ElementMixin):
 
 class OsmDocument(object):
 	"""
-	A pure container. Packs nodes, ways and relations together.
+	A pure container. Packs nodes, ways and relations together, with the coordinates of the nodes and the strings shared by the elements.
 	"""
 	classes = {
 		'node': Node,
@@ -200,13 +344,62 @@ class OsmDocument(object):
 			'way': self.ways,
 			'relation': self.relations,
 		}
+		self.lats = array('d')
+		self.lons = array('d')
+		self.strings = {}
+		self.attrs_tuples = {}
+
+	def intern(self, string):
+		"""
+		Returns the same instance for equal strings, so the repeated tag keys and values are stored once. Unlike sys.intern(), the strings are freed with the document.
+		"""
+		return self.strings.setdefault(string, string)
+
+	def intern_attrs(self, attrs):
+		"""
+		Returns the attributes as a tuple of (key, value) pairs, the same tuple for equal attributes.
+		"""
+		items = tuple(sorted((self.intern(k), self.intern(v)) for k, v in attrs.items()))
+		return self.attrs_tuples.setdefault(items, items)
+
+
+# The children elements loaded with each type of element
+CHILDREN = {
+	'node': ('tag',),
+	'way': ('nd', 'tag'),
+	'relation': ('member', 'tag'),
+}
+
+# The attributes each type of element needs to be built
+REQUIRED_ATTRIBUTES = {
+	'node': ('id', 'lat', 'lon'),
+	'way': ('id',),
+	'relation': ('id',),
+}
 
 
-def load(stream):
+def load(stream, element_types=None, attributes=None):
 	"""
 	Imports OSM XML document from `stream`, returns a named tuple with .nodes, .ways and .relations with the document elements.
+
+	For a partial load, `element_types` names the elements kept, e.g. ('relation',) to read only the relations and their members, and `attributes` the attributes kept besides the ids and the coordinates, e.g. () to drop all of them. The other elements are skipped by the element filter of load_osm, so no object is built for them. The members and the nodes of the ways kept still refer to the ids of the skipped elements.
 	"""
 	doc = OsmDocument()
+	element_types = set(element_types or doc.classes)
+	# The children allowed inside the current element, set at the start of every element
+	allowed_children = [()]
+
+	def element_filter(element):
+		name = element['name']
+		if name in doc.classes:
+			keep = name in element_types
+			allowed_children[0] = CHILDREN[name] if keep else ()
+			if keep and attributes is not None:
+				for k in list(element['attrs']):
+					if k not in attributes and k not in REQUIRED_ATTRIBUTES[name]:
+						del element['attrs'][k]
+			return keep
+		return name in allowed_children[0]
 
 	def load_callback(current, parent):
 		"""
@@ -220,11 +413,11 @@ def load(stream):
 		else:
 			parent['children'].append(current)
 
-	load_osm(stream, load_callback=load_callback)
+	load_osm(stream, load_callback=load_callback, element_filter=element_filter)
 	return doc
 
 
-def dump(stream, doc):
+def dump(stream, doc, dump_func=dump_osm):
 	"""
 	Exports the `doc` OsmDocument instance into OSM XML and dumps it into `stream`.
 	"""
@@ -233,18 +426,33 @@ def dump(stream, doc):
 		doc.ways.items(),
 		doc.relations.items()
 	))
-	dump_osm(stream, items)
+	dump_func(stream, items)
+
+
+def benchmark(infile, repeat=3):
+	"""
+	Compares the times of dump_osm and the former SAX dumper writing the document of `infile`.
+	"""
+	import os
+	import timeit
+	doc = load(infile)
+	with open(os.devnull, 'wb') as devnull:
+		for dump_func in (dump_osm_sax, dump_osm):
+			best = min(timeit.repeat(lambda: dump(devnull, doc, dump_func), number=1, repeat=repeat))
+			sys.stderr.write('%s: %.3f s\n' % (dump_func.__name__, best))
 
 
 if __name__ == '__main__':
 	infilename = sys.argv[1]
-	open_func = bz2.BZ2File if infilename.endswith('.bz2') else open
-	with open_func(infilename) as infile:
-		if len(sys.argv) > 2:
+	with open_osm(infilename) as infile:
+		if len(sys.argv) > 2 and sys.argv[2] == 'benchmark':
+			benchmark(infile)
+
+		elif len(sys.argv) > 2:
 			from cProfile import Profile
 			p = Profile()
-			stat = p.runctx('dump(tgt, load(src))', {'load': load, 'dump': dump, 'src': infile, 'tgt': sys.stdout}, {})
+			stat = p.runctx('dump(tgt, load(src))', {'load': load, 'dump': dump, 'src': infile, 'tgt': sys.stdout.buffer}, {})
 			stat.print_stats()
 
 		else:
-			dump(sys.stdout, load(infile))
+			dump(sys.stdout.buffer, load(infile))
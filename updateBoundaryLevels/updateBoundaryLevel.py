@@ -1,31 +1,65 @@
 # -*- coding: utf-8 -*-
-# Use python2, since osm2python is not ported to python3
+# Runs with python3 (osm2python has been ported to it)
+#
+# Sets in every way the admin_level tag of the lowest level relation it belongs to.
+# With --streaming, the file is read twice and never loaded whole: first only the relations, to find the
+# admin_level of every way, then it's copied element by element adding the tags to the ways.
 
+import sys
+
+from osm2python import copy_osm, open_osm
 from osm2python.tree import load, dump
 from collections import defaultdict
 
 origin_osm_filename = 'boundaries.osm'
 destiny_osm_filename = 'boundaries_updated.osm'
 
-# loading the .osm file
-osmtree = load(open(origin_osm_filename))
 
-ways_min_admin_levels = defaultdict(int)
-for i, r in osmtree.relations.items():
-    if 'admin_level' in r.tags:
-        admin_level = int(r.tags['admin_level'])
-    else:
-        print(r, 'has no admin_level')
+def min_admin_levels(relations):
+    ways_min_admin_levels = defaultdict(int)
+    for i, r in relations.items():
+        if 'admin_level' in r.tags:
+            admin_level = int(r.tags['admin_level'])
+        else:
+            print(r, 'has no admin_level')
+
+        for way in r.members:
+            if ways_min_admin_levels[way.ref] == 0 or ways_min_admin_levels[way.ref] > admin_level:
+                ways_min_admin_levels[way.ref] = admin_level
+                print(way.ref, admin_level)
+    return ways_min_admin_levels
+
+
+if '--streaming' in sys.argv:
+    # first pass, only the relations
+    ways_min_admin_levels = min_admin_levels(load(open_osm(origin_osm_filename), element_types=('relation',), attributes=()).relations)
+
+    # second pass, copying the elements
+    def set_admin_level(element):
+        if element['name'] != 'way':
+            return
+        level = str(ways_min_admin_levels.get(int(element['attrs']['id']), 0))
+        tags = [child for child in element['children'] if child['name'] == 'tag']
+        for tag in tags:
+            if tag['attrs']['k'] == 'admin_level':
+                tag['attrs']['v'] = level
+                break
+        else:
+            element['children'].append({'name': 'tag', 'attrs': {'k': 'admin_level', 'v': level}})
+        print(element['attrs']['id'], dict((child['attrs']['k'], child['attrs']['v']) for child in element['children'] if child['name'] == 'tag'))
+
+    copy_osm(open_osm(origin_osm_filename), open(destiny_osm_filename, 'wb'), set_admin_level)
+
+else:
+    # loading the .osm file
+    osmtree = load(open_osm(origin_osm_filename))
 
-    for way in r.members:
-        if ways_min_admin_levels[way.ref] == 0 or ways_min_admin_levels[way.ref] > admin_level:
-            ways_min_admin_levels[way.ref] = admin_level
-            print(way.ref, admin_level)
+    ways_min_admin_levels = min_admin_levels(osmtree.relations)
 
-for i, w in osmtree.ways.items():
+    for i, w in osmtree.ways.items():
 
-    w.tags['admin_level'] = str(ways_min_admin_levels[i])
-    print(i, w.tags)
+        w.tags['admin_level'] = str(ways_min_admin_levels[i])
+        print(i, w.tags)
 
-# Saving to .osm
-dump(open(destiny_osm_filename, 'w'), osmtree)
+    # Saving to .osm
+    dump(open(destiny_osm_filename, 'wb'), osmtree)